@@ -1,9 +1,16 @@
 import unittest
+import asyncio
 
 from treematching.matchingbtree import *
 from treematching.btitems import *
+from treematching.match import *
 from treematching.debug import *
 
+HOOK_LIMIT = 1
+
+def _hook_limit(capture, user_data):
+    return len(capture) > HOOK_LIMIT
+
 class Dummy:
     def __init__(self, **kw):
         self.__dict__.update(kw)
@@ -38,6 +45,9 @@ class CD(DummyDict): pass
 class DD(DummyDict): pass
 class ED(DummyDict): pass
 
+def keep_hook(capture, user_data):
+    return False
+
 class TestBTP(unittest.TestCase):
     def test_00(self):
         """
@@ -642,3 +652,826 @@ class TestBTP(unittest.TestCase):
         self.assertEqual(len(match), 1, "Failed to match a Ancestor")
 
     # TODO: Event, Condition
+
+    def test_16(self):
+        """
+        Match result
+        """
+        bt = Capture('a', Type(A, Attrs(Attr('v', Type(int)))))
+        e = MatchingBTree(bt, name='rule_a')
+        tree = {'cool': [B(v=1), C(v=A(v=2))]}
+        match = e.match(tree)
+        self.assertEqual(len(match), 1, "Failed to match")
+        self.assertIsInstance(match[0], Match, "Failed to return a Match")
+        self.assertIs(match[0].capture['a'], tree['cool'][1].v, "Failed to capture correctly")
+        self.assertEqual(match[0].uid, [(0, 0), (1, 0), (2, 1), (3, 0)], "Failed to give the uid of the matched node")
+        self.assertEqual(match[0].pattern, 'rule_a', "Failed to give the pattern id")
+        # slotted, no context tree kept
+        self.assertFalse(hasattr(match[0], '__dict__'), "Match must be slotted")
+        bt = Type(A)
+        match = MatchingBTree(bt).match([A()])
+        self.assertEqual(match[0].capture, {}, "Failed to give empty captures")
+        self.assertIsNone(match[0].pattern, "Failed to give default pattern id")
+        self.assertEqual((match[0].event, match[0].nb_modif), (set(), 0), "Failed to give empty events")
+        # the events and the Hook modifications are kept
+        bt = Event('seen', Hook(lambda c, u: True, Capture('a', Type(A))))
+        match = MatchingBTree(bt).match([A(), B()])
+        self.assertEqual(len(match), 1, "Failed to match an Event")
+        self.assertEqual(match[0].event, {'seen'}, "Failed to give the events")
+        self.assertEqual(match[0].nb_modif, 1, "Failed to count the Hook modifications")
+
+    def test_17(self):
+        """
+        Path of matches
+        """
+        bt = Type(A, Attrs(Attr('v', Type(int, Value(32)))))
+        e = MatchingBTree(bt)
+        tree = {'cool': [B(v=32), C(v=A(v=12)), A(v=32)], 'plum': AD({'x': C(w=A(v=32))})}
+        match = e.match(tree)
+        self.assertEqual(len(match), 2, "Failed to match")
+        self.assertIsNone(match[0].path, "Path must be optional")
+        match = e.match(tree, path=True)
+        self.assertEqual(len(match), 2, "Failed to match with path")
+        self.assertEqual(match[0].path.keys(), ['cool', 2], "Failed to give the path")
+        self.assertEqual(match[1].path.keys(), ['plum', 'x', 'w'], "Failed to give the path")
+        self.assertEqual(match[1].path.steps(), [('key', 'plum'), ('key', 'x'), ('attr', 'w')], "Failed to give the steps")
+        nodes = match[1].path.nodes()
+        self.assertIs(nodes[0], tree, "Failed to give the root")
+        self.assertIs(nodes[-1], tree['plum']['x'].w, "Failed to give the matched node")
+        self.assertIs(match[1].path.parent.node, tree['plum']['x'], "Failed to give the parent")
+        # prefix is shared between siblings
+        bt = Type(int)
+        match = MatchingBTree(bt).match(C(v=[1, 2]), path=True)
+        self.assertEqual([m.path.keys() for m in match], [['v', 0], ['v', 1]], "Failed to give the path")
+        self.assertIs(match[0].path.parent, match[1].path.parent, "Failed to share the prefix")
+
+    def test_18(self):
+        """
+        Trace ring
+        """
+        from treematching.tracedump import decode
+        bt = Capture('a', Type(A, Attrs(Attr('v', Type(int)))))
+        e = MatchingBTree(bt)
+        tree = [B(v=1), A(v=2)]
+        ring = ring_on(1000)
+        try:
+            match = e.match(tree)
+        finally:
+            ring_off()
+        self.assertEqual(len(match), 1, "Failed to match with the trace ring")
+        self.assertLess(ring.count, 1000, "Failed to record in the trace ring")
+        lines = list(decode(ring.dump(bt)))
+        self.assertEqual(len([l for l in lines if 'SET RES' in l]), ring.count, "Failed to decode all records")
+        self.assertTrue([l for l in lines if l.startswith('Capture') and l.endswith('TO SUCCESS')], "Failed to decode the success")
+        # bounded
+        ring = ring_on(8)
+        try:
+            e.match(tree)
+        finally:
+            ring_off()
+        self.assertGreater(ring.count, 8, "Failed to record in the trace ring")
+        lines = list(decode(ring.dump(bt)))
+        self.assertEqual(len([l for l in lines if 'SET RES' in l]), 8, "Failed to bound the trace ring")
+        last = len(list(walk(tree))) - 1
+        self.assertIn("EVENT %d" % last, lines, "Failed to keep the last records")
+        self.assertNotIn("EVENT 0", lines, "Failed to drop the first records")
+
+    def test_19(self):
+        """
+        Budgets
+        """
+        bt = Type(A, Attrs(Attr('v', Type(int))))
+        e = MatchingBTree(bt)
+        tree = [A(v=1), B(v=2), A(v=3)]
+        match = e.match(tree)
+        self.assertEqual(len(match), 2, "Failed to match")
+        self.assertEqual(match.status, Status.COMPLETE, "Failed to complete")
+        self.assertIsNone(match.exceeded, "Failed to complete")
+        self.assertEqual(match.events, len(list(walk(tree))), "Failed to count events")
+        self.assertGreaterEqual(match.ticks, match.events, "Failed to count ticks")
+        self.assertGreaterEqual(match.contexts, 1, "Failed to count contexts")
+        # stop after the first A
+        match = e.match(tree, max_events=6)
+        self.assertEqual(match.status, Status.BUDGET_EXCEEDED, "Failed to stop on events")
+        self.assertEqual(match.exceeded, 'max_events', "Failed to stop on events")
+        self.assertEqual(match.events, 6, "Failed to stop on events")
+        self.assertEqual(len(match), 1, "Failed to give partial results")
+        match = e.match(tree, max_ticks=10)
+        self.assertEqual(match.exceeded, 'max_ticks', "Failed to stop on ticks")
+        self.assertEqual(match.ticks, 10, "Failed to stop on ticks")
+        match = e.match(tree, timeout=-1)
+        self.assertEqual(match.exceeded, 'timeout', "Failed to stop on time")
+        self.assertEqual(match.events, 0, "Failed to stop on time")
+        # a not strict Ancestor keeps its contexts running
+        bt = Ancestor(Type(C), AnyType(), strict=False)
+        match = MatchingBTree(bt).match(tree, max_contexts=5)
+        self.assertEqual(match.exceeded, 'max_contexts', "Failed to stop on live contexts")
+        self.assertEqual(match.contexts, 5, "Failed to stop on live contexts")
+
+    def test_20(self):
+        """
+        Projection
+        """
+        from treematching.analysis import Projection
+        bt = Type(A, Attrs(Attr('name', Type(str)), Attr('body', AnyType()), strict=False))
+        e = MatchingBTree(bt)
+        tree = [A(name='a', body=B(v=1), cache=[list(range(50))]), B(name='b', cache={'k': [1, 2, 3]}),
+                C(cache=A(name='c', body=1))]
+        full = e.match(tree)
+        self.assertEqual(len(full), 2, "Failed to match")
+        # A under cache is not searched
+        match = e.match(tree, project=True)
+        self.assertEqual(len(match), 1, "Failed to match with projection")
+        self.assertEqual(match[0].uid, full[0].uid, "Failed to match the same node")
+        self.assertLess(match.events, full.events // 4, "Failed to skip the unused attributes")
+        self.assertEqual(len(e.match(tree, anchored=True)), 1, "Failed to match anchored")
+        # the default walk finds the matches under any name
+        e = MatchingBTree(Type(C, Attrs(Attr('c', AnyType()), strict=False)))
+        tree = B(a=1, b=C(c=2))
+        self.assertEqual(len(e.match(tree)), 1, "Failed to match under an unnamed attribute")
+        self.assertEqual(len(e.match(tree, project=True)), 0, "Failed to skip an unnamed attribute")
+        self.assertEqual(len(e.match(tree, anchored=True)), 0, "Failed to anchor the walk")
+        self.assertEqual(len(e.match([tree.b, tree], anchored=True)), 1, "Failed to walk the items")
+        # an axis never named is walked by project, not when anchored
+        tree = {'k': C(c=1)}
+        self.assertEqual(len(e.match(tree, project=True)), 1, "Failed to walk the keys")
+        self.assertEqual(len(e.match(tree, anchored=True)), 0, "Failed to anchor the keys")
+        self.assertEqual(e.count(tree, None, True), 1, "Failed to keep project positional")
+        tree = [A(name='a', body=B(v=1), cache=[list(range(50))])]
+        # strict count stay on all the attributes
+        bt = Type(A, Attrs(Attr('name', Type(str)), Attr('body', AnyType())))
+        self.assertEqual(len(MatchingBTree(bt).match(tree, project=True)), 0, "Failed to keep strict Attrs")
+        self.assertEqual(len(MatchingBTree(bt).match(tree, anchored=True)), 0, "Failed to keep strict Attrs")
+        # wildcards are conservative
+        self.assertIsNone(Projection(Type(A, Attrs(AnyAttr(Type(int)), Attr('v', AnyType())))).attrs, "Failed to handle AnyAttr")
+        self.assertIsNone(Projection(Ancestor(Type(A), Attrs(Attr('v', AnyType())))).attrs, "Failed to handle Ancestor")
+        proj = Projection(Type(AD, Dict(Key('a', AnyType()), Key('b', AnyType()))))
+        self.assertEqual(proj.keys, {'a', 'b'}, "Failed to collect the keys")
+        self.assertIsNone(proj.attrs, "Failed to keep the unconstrained attributes")
+        proj = Projection(Type(AD, Dict(Key('a', AnyType()))), anchored=True)
+        self.assertEqual((proj.keys, proj.attrs), ({'a'}, frozenset()), "Failed to anchor the unconstrained attributes")
+
+    def test_21(self):
+        """
+        Scope expiry of live contexts
+        """
+        from treematching.analysis import height
+        self.assertEqual(height(Type(A)), 0, "Failed to compute height")
+        self.assertEqual(height(Type(A, Attrs(Attr('v', Type(AL, List(AnyIdx(Type(int)))))))), 2, "Failed to compute height")
+        self.assertEqual(height(Ancestor(Type(A), Type(B), 2)), 2, "Failed to compute height")
+        self.assertIsNone(height(Ancestor(Type(A), Type(B), 2, strict=False)), "Failed to compute height")
+        self.assertIsNone(height(Sibling(Type(A), Type(B))), "Failed to compute height")
+        # Any ends on its first success or once all its subs failed
+        bt = Any(Type(A), Type(B))
+        tree = [[A(), B()] for _ in range(50)]
+        match = MatchingBTree(bt).match(tree)
+        self.assertEqual(len(match), 100, "Failed to match Any")
+        self.assertLess(match.contexts, 10, "Failed to bound the live contexts")
+        # strict Ancestor wait for its ancestor only inside its scope
+        bt = Capture('a', Ancestor(Type(A), Type(B), 2))
+        tree = [C(v=C(w=B())), C(v=A(w=C(x=B()))), A(w=[B()]), [A(w=C(x=B()))]]
+        match = MatchingBTree(bt).match(tree)
+        self.assertEqual([m.capture['a'] for m in match], [tree[1].v, tree[2], tree[3][0]], "Failed to match Ancestor")
+        self.assertGreater(match.expired, 0, "Failed to expire contexts")
+
+    def test_22(self):
+        """
+        Live contexts order on wide lists
+        """
+        bt = Capture('a', Type(AL, List(AnyIdx(Type(int, Value(32))), AnyIdx(Type(str)), strict=False)))
+        tree = [AL([32, 'toto', 100 + i]) if i % 3 else AL([i, 'toto']) for i in range(200)]
+        match = MatchingBTree(bt).match(tree)
+        expected = [t for t in tree if t[0] == 32]
+        self.assertEqual(len(match), len(expected), "Failed to match a wide list")
+        for m, t in zip(match, expected):
+            self.assertIs(m.capture['a'], t, "Failed to keep the match order")
+
+    def test_23(self):
+        """
+        Lazy reset of contexts
+        """
+        bt = Type(AL, AnyList(), Attrs(Attr('v', Type(int)), strict=False))
+        ctx = MatchContext()
+        ctx.init_state(bt)
+        ctx.state = 'concurrent'
+        ctx.init_steps(bt)
+        ctx.steps[0].res = State.SUCCESS
+        ctx.steps[1].init_subs(bt.steps[1].subs)
+        ctx.steps[1].subs[0].res = State.FAILED
+        ctx.uid = [(0, 0)]
+        ctx.reset_tree()
+        self.assertEqual(ctx.res, State.RUNNING, "Failed to reset")
+        self.assertFalse(hasattr(ctx, 'uid'), "Failed to reset")
+        # children are only reset on their next tick
+        self.assertEqual(ctx.steps[0].res, State.SUCCESS, "Failed to reset lazily")
+        ctx.init_steps(bt)
+        self.assertEqual(ctx.steps[0].res, State.RUNNING, "Failed to reset the steps")
+        self.assertEqual(ctx.steps[1].subs[0].res, State.FAILED, "Failed to reset lazily")
+        ctx.steps[1].init_subs(bt.steps[1].subs)
+        self.assertEqual(ctx.steps[1].subs[0].res, State.RUNNING, "Failed to reset the subs")
+
+    def test_24(self):
+        """
+        asyncio API
+        """
+        bt = Capture('a', Type(A))
+        tree = [A(), [B(), A()], A()]
+        expected = MatchingBTree(bt).match(tree)
+
+        async def events():
+            for it in walk(tree):
+                yield it
+
+        async def run():
+            m = MatchingBTree(bt)
+            res = [await m.amatch(tree, every=1),
+                   await m.amatch(events()),
+                   await m.amatch(tree, offload=3)]
+            found = [x async for x in m.aiter_match(tree, every=2)]
+            return res, found
+
+        res, found = asyncio.run(run())
+        for r in res:
+            self.assertEqual([m.capture['a'] for m in r], [m.capture['a'] for m in expected], "Failed to amatch")
+        self.assertEqual([m.capture['a'] for m in found], [m.capture['a'] for m in expected], "Failed to aiter_match")
+
+        # cancellation
+        async def cancel():
+            task = asyncio.ensure_future(MatchingBTree(bt).amatch([A()] * 10000, every=1))
+            await asyncio.sleep(0)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                return True
+            return False
+
+        self.assertTrue(asyncio.run(cancel()), "Failed to cancel amatch")
+
+    def test_25(self):
+        """
+        Immutable matcher shared by threads
+        """
+        m = MatchingBTree(Capture('a', Type(A, Attrs(Attr('v', Type(int, Capture('v', AnyValue())))))), 'a')
+        with self.assertRaises(AttributeError, msg="Failed to forbid modification"):
+            m.bt = None
+        trees = [[A(v=i), B(v=i), [A(v=i * 2)]] for i in range(64)]
+        expected = [[m.capture['v'] for m in m.match(t)] for t in trees]
+        self.assertEqual(expected[3], [3, 6], "Failed to match")
+        res = m.match_many(trees, max_workers=8)
+        self.assertEqual([[x.capture['v'] for x in r] for r in res], expected, "Failed to match in threads")
+        import threading
+        out = [None] * 8
+        def work(n):
+            out[n] = [[x.capture['v'] for x in m.match(t)] for t in trees]
+        ths = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+        for t in ths:
+            t.start()
+        for t in ths:
+            t.join()
+        self.assertEqual(out, [expected] * 8, "Failed to share a matcher between threads")
+
+    def test_26(self):
+        """
+        Numeric vectors as leaves
+        """
+        import array
+        samples = array.array('d', [0.5 * i for i in range(100000)])
+        self.assertEqual([e[0] for e in walk(samples)], ['vector', 'type'], "Failed to walk a vector")
+        self.assertNotIn('vector', [e[0] for e in walk(array.array('u', 'abc'))], "Failed to walk a text array")
+        # duck typed like a numpy scalar, 0-d is not a vector
+        class Scalar(float):
+            dtype = type('dtype', (), {'kind': 'f'})()
+            ndim = 0
+        self.assertNotIn('vector', [e[0] for e in walk(Scalar(1.5))], "Failed to walk a 0-d scalar")
+        tree = [A(v=samples), A(v=array.array('i', [3, -1, 7])), A(v=array.array('i'))]
+        def found(sub):
+            bt = Capture('a', Type(A, Attrs(Attr('v', Type(array.array, sub)))))
+            return [tree.index(m.capture['a']) for m in MatchingBTree(bt).match(tree)]
+        self.assertEqual(found(AnyVector()), [0, 1, 2], "Failed to match AnyVector")
+        self.assertEqual(found(AllInRange(0, None)), [0, 2], "Failed to match AllInRange")
+        self.assertEqual(found(AllInRange(-1, 7)), [1, 2], "Failed to match AllInRange")
+        self.assertEqual(found(SomeInRange(4, 6)), [0], "Failed to match SomeInRange")
+        self.assertEqual(found(SomeInRange(None, 0)), [0, 1], "Failed to match SomeInRange")
+        self.assertEqual(found(SomeInRange(2.9, 3.1)), [0, 1], "Failed to match SomeInRange")
+        self.assertEqual(found(SomeInRange(-1, 0)), [0, 1], "Failed to match SomeInRange")
+        self.assertEqual(found(Contains(-1)), [1], "Failed to match Contains")
+        self.assertEqual(found(Contains(49999.5)), [0], "Failed to match Contains")
+
+    def test_27(self):
+        """
+        Buffers as values
+        """
+        import re
+        import mmap
+        payload = bytearray(b'\x7fELF' + b'\x00' * 65536 + b'END')
+        self.assertEqual([e[0] for e in walk(payload)], ['value', 'type'], "Failed to walk a bytearray")
+        self.assertEqual([e[0] for e in walk(memoryview(payload))], ['value', 'type'], "Failed to walk a memoryview")
+        m = mmap.mmap(-1, 16)
+        m[:4] = b'\x7fELF'
+        tree = [A(v=payload), A(v=memoryview(b'GET / HTTP/1.1')), A(v=m), A(v='\x7fELF'), A(v=3)]
+        def found(sub):
+            bt = Capture('a', Type(A, Attrs(Attr('v', Capture('v', AnyType(sub))))))
+            return [tree.index(m.capture['a']) for m in MatchingBTree(bt).match(tree)]
+        self.assertEqual(found(Prefix(b'\x7fELF')), [0, 2], "Failed to match Prefix")
+        self.assertEqual(found(Prefix('\x7fELF')), [3], "Failed to match Prefix")
+        self.assertEqual(found(Suffix(b'END')), [0], "Failed to match Suffix")
+        self.assertEqual(found(Length(10, 100)), [1, 2], "Failed to match Length")
+        self.assertEqual(found(Length(None, 4)), [3], "Failed to match Length")
+        self.assertEqual(found(Regex(re.compile(rb'HTTP/1\.[01]$'))), [1], "Failed to match Regex")
+        self.assertEqual(found(Regex('^\x7f')), [3], "Failed to match Regex")
+        m.close()
+        # strided buffers have no bytes view, not a match but no error
+        import array
+        strided = memoryview(bytearray(b'abcdef'))[::2]
+        for item in (Regex(rb'a'), Prefix(b'a'), Suffix(b'e')):
+            self.assertFalse(item.test(strided), "Failed to skip a strided buffer")
+        self.assertTrue(Length(8, 8).test(memoryview(array.array('i', range(4)))[::2]), "Failed to measure a strided buffer")
+        # a released view is a value without content, decided by instance
+        released = memoryview(b'abc')
+        released.release()
+        self.assertEqual([e[0] for e in walk(released)], ['value', 'type'], "Failed to walk a released view")
+        for item in (Regex(rb'a'), Prefix(b'a'), Length(0, 10)):
+            self.assertFalse(item.test(released), "Failed to skip a released view")
+        self.assertTrue(Prefix(b'a').test(memoryview(b'abc')), "Failed to match a view after a released one")
+        from treematching.matchingbtree import _buffer_types
+        self.assertNotIn(memoryview, _buffer_types, "Failed to decide memoryview by instance")
+
+    def test_28(self):
+        """
+        Set, range and regex values
+        """
+        import re
+        allowed = In('id%d' % i for i in range(5000))
+        tree = [A(v='id42'), A(v='other'), A(v=bytearray(b'id1')), {'id7': 12, 'x': 2.5, 'y': 'a'}, [3, 'id4999']]
+        bt = Capture('a', Type(A, Attrs(Attr('v', AnyType(allowed)))))
+        self.assertEqual([m.capture['a'] for m in MatchingBTree(bt).match(tree)], [tree[0]], "Failed to match In")
+        bt = Capture('k', Key('x', Type(float, Range(1, 3))))
+        self.assertEqual(len(MatchingBTree(bt).match(tree)), 1, "Failed to match Range")
+        bt = Capture('v', Type(int, Range(10)))
+        self.assertEqual([m.capture['v'] for m in MatchingBTree(bt).match(tree)], [12], "Failed to match Range")
+        bt = Capture('v', Type(str, Range('id4', 'id5')))
+        self.assertEqual([m.capture['v'] for m in MatchingBTree(bt).match(tree)], ['id42', 'id4999'], "Failed to match Range")
+        bt = Capture('v', Type(str, Regex(re.compile(r'^id\d+$'))))
+        self.assertEqual([m.capture['v'] for m in MatchingBTree(bt).match(tree)], ['id42', 'id4999'], "Failed to match Regex")
+        bt = Capture('v', Type(str, allowed))
+        self.assertEqual([m.capture['v'] for m in MatchingBTree(bt).match(tree)], ['id42', 'id4999'], "Failed to match In")
+
+    def test_29(self):
+        """
+        Attrs and Dict route the events by branch name
+        """
+        fields = ['f%02d' % i for i in range(50)]
+        bt = Capture('r', Type(A, Attrs(*[Attr(f, Type(int)) for f in fields], strict=False)))
+        good = A(**{f: i for i, f in enumerate(fields)})
+        bad = A(**{f: i for i, f in enumerate(fields)})
+        bad.f25 = 'x'
+        partial = A(**{f: i for i, f in enumerate(fields[:-1])})
+        tree = [good, bad, partial, B(v=good), A(extra=1, **{f: 0 for f in fields})]
+        match = MatchingBTree(bt).match(tree)
+        self.assertEqual([m.capture['r'] for m in match], [good, good, tree[4]], "Failed to match a schema")
+        # only the sub of the branch can start
+        attrs = bt.second.second
+        events = list(walk(A(f03=1), path=Path(None, None, None, None)))
+        self.assertEqual(attrs.route(events[0]), {3}, "Failed to route an event")
+        self.assertIsNone(attrs.route(events[0][:4]), "Failed to route without path")
+        bt = Capture('d', Type(dict, Dict(Key('a', Type(int)), Key('b', AnyType()), AnyKey(Type(str)))))
+        tree = [{'a': 1, 'b': [1], 'c': 'x'}, {'a': 1, 'b': 2, 'c': 3}, {'b': 1, 'c': 'x', 'd': 'y'}]
+        match = MatchingBTree(bt).match(tree)
+        self.assertEqual([m.capture['d'] for m in match], [tree[0]], "Failed to match a Dict")
+
+    def test_30(self):
+        """
+        Any dispatch its Type subs by type
+        """
+        class D(A): pass
+        seen = []
+        bt = Any(Type(A, Attrs(Attr('v', Type(int)))), Type(B), KindOf(A), Type(C, Hook(lambda *a: seen.append(1), AnyValue())), AnyType())
+        self.assertEqual(bt.routed, {0, 1, 2}, "Failed to index the Type subs")
+        self.assertEqual(bt.unrouted, {3, 4}, "Failed to keep the other subs")
+        tree = D(v=1)
+        events = list(walk(tree, path=Path(None, None, None, tree)))
+        self.assertEqual(bt.route(events[-1]), {2}, "Failed to route by MRO")
+        self.assertEqual(bt.route(events[0]), set(), "Failed to route by height")
+        self.assertIn(D, bt.mro_cache, "Failed to cache the MRO")
+        tree = A(v=B())
+        events = list(walk(tree, path=Path(None, None, None, tree)))
+        self.assertEqual(bt.route(events[0]), {0, 1}, "Failed to route an event")
+        self.assertIsNone(bt.route(events[0][:4]), "Failed to route without path")
+        # subs are only created for the routed types
+        tree = D(v=1)
+        ctx = MatchContext()
+        events = list(walk(tree, path=Path(None, None, None, tree)))
+        self.assertEqual(bt.do(events[-1], ctx, None), State.SUCCESS, "Failed to match Any")
+        self.assertIsNone(ctx.subs[1], "Failed to skip a sub")
+        self.assertIsNotNone(ctx.subs[2], "Failed to tick a sub")
+        # alternatives, with and without routing
+        class E(C): pass
+        bt = Capture('a', Any(Type(A, Attrs(Attr('v', Type(int)))), Type(B), KindOf(C)))
+        tree = [A(v=1), A(v='x'), B(), E(), D(v=2), [C()]]
+        e = MatchingBTree(bt)
+        self.assertEqual([m.capture['a'] for m in e.match(tree)], [tree[0], tree[2], tree[3], tree[5][0]], "Failed to match Any")
+        run = MatchRun(e, path=False)
+        run.feed_all(walk(tree))
+        self.assertEqual([m.capture['a'] for m in run.finish()], [tree[0], tree[2], tree[3], tree[5][0]], "Failed to match Any without routing")
+        # the MRO cache is bounded
+        from treematching.btitems import MRO_CACHE_SIZE
+        any_ = bt.second
+        for i in range(MRO_CACHE_SIZE + 10):
+            self.assertEqual(any_.kindof(type('G%d' % i, (C,), {})), [(2, 0)], "Failed to dispatch by MRO")
+        self.assertLessEqual(len(any_.mro_cache), MRO_CACHE_SIZE, "Failed to bound the MRO cache")
+
+    def test_31(self):
+        """
+        Patterns sharing sub-patterns
+        """
+        from treematching.analysis import intern, share, items
+        def fields():
+            return Attrs(Attr('v', Type(B)), Attr('w', Type(int, In({1, 2}))), strict=False)
+        self.assertIs(intern(fields(), {}) is intern(fields(), {}), False, "Failed to separate the tables")
+        table = {}
+        self.assertIs(intern(fields(), table), intern(fields(), table), "Failed to intern a pattern")
+        self.assertIsNot(intern(Type(int, Value(1)), table), intern(Type(int, Value(True)), table), "Failed to keep the value types")
+        pats = {
+            'a': Capture('x', Type(A, fields())),
+            'a2': Capture('x', Type(A, fields())),
+            'c': Capture('x', Type(C, fields())),
+            'k': Capture('x', KindOf(A, Attrs(Attr('w', Type(int, In({1, 2}))), Attr('u', Type(str)), strict=False))),
+        }
+        roots = share(list(pats.values()))
+        self.assertIs(roots[0], roots[1], "Failed to merge equal patterns")
+        self.assertTrue([it for it in items(roots[2]) if isinstance(it, Shared)], "Failed to share a sub-pattern")
+        class D(A): pass
+        tree = [A(v=B(), w=1), C(v=B(), w=2, u='x'), A(v=B(), w=3), B(v=D(v=B(), w=2, u='y')), [C(v=A(), w=1)]]
+        forest = MatchingForest(pats)
+        res = forest.match(tree, path=True)
+        expected = []
+        for name, bt in pats.items():
+            expected += [(m.uid, name, m.capture['x'], m.path.keys()) for m in MatchingBTree(bt, name).match(tree, path=True)]
+        got = [(m.uid, m.pattern, m.capture['x'], m.path.keys()) for m in res]
+        self.assertEqual(sorted(got, key=repr), sorted(expected, key=repr), "Failed to match a forest")
+        self.assertEqual([m.pattern for m in res if m.capture['x'] is tree[0]], ['a', 'a2'], "Failed to fan out the matches")
+        # Shared is transparent without a forest
+        got = [(m.uid, m.capture['x']) for m in MatchingBTree(roots[2]).match(tree)]
+        self.assertEqual(got, [(m.uid, m.capture['x']) for m in MatchingBTree(pats['c']).match(tree)], "Failed to match a Shared")
+
+    def test_32(self):
+        """
+        Serialized patterns
+        """
+        import re
+        from treematching import serialize
+        bt = Capture('a', Type(A, Attrs(Attr('v', Type(int, Hook(keep_hook, AnyValue()))),
+                                        Attr('w', AnyType(Regex(re.compile('^x')))), strict=False)))
+        m = MatchingBTree(bt, 'rule')
+        data = serialize.dumps(m)
+        self.assertTrue(data.startswith(serialize.MAGIC), "Failed to write the header")
+        m2 = serialize.loads(data)
+        self.assertIsInstance(m2, MatchingBTree, "Failed to load a matcher")
+        self.assertEqual(m2.scope_height(), m.scope_height(), "Failed to keep the analysis")
+        with self.assertRaises(AttributeError, msg="Failed to keep the matcher immutable"):
+            m2.name = 'x'
+        tree = [A(v=1, w='xy'), A(v=2, w='y'), B(v=A(v=3, w='x'))]
+        self.assertEqual([x.capture['a'] for x in m2.match(tree)], [tree[0], tree[2].v], "Failed to match after load")
+        forest = serialize.loads(serialize.dumps(MatchingForest({'a': bt, 'k': Capture('a', KindOf(A))})))
+        self.assertEqual(len(forest.match(tree)), 5, "Failed to load a forest")
+        with self.assertRaises(ValueError, msg="Failed to check the header"):
+            serialize.loads(b'TMPT\x09' + data[5:])
+        with self.assertRaises(ValueError):
+            serialize.loads(b'TMPT\x01' + data[5:])
+        with self.assertRaises(ValueError, msg="Failed to check the header"):
+            serialize.loads(b'junk')
+        # a change of the attributes of an item is detected
+        self.assertIn('steps', serialize.layout(Type), "Failed to give the layout")
+        def renamed(self):
+            self.stages = self.steps
+        Type.renamed = renamed
+        try:
+            with self.assertRaises(ValueError, msg="Failed to check the layout"):
+                serialize.loads(data)
+        finally:
+            del Type.renamed
+        self.assertIsInstance(serialize.loads(data), MatchingBTree, "Failed to load an unchanged layout")
+
+    def test_33(self):
+        """
+        Textual patterns
+        """
+        import ast
+        from treematching import dsl
+        ns = {'A': A, 'B': B}
+        m = dsl.compile("Capture(a, Type(A, Attrs(Attr(v, Type(int, In({1, 2, -3}))), strict=False)))", ns, 'r')
+        self.assertIs(dsl.compile("Capture(a, Type(A, Attrs(Attr(v, Type(int, In({1, 2, -3}))), strict=False)))", ns, 'r'), m, "Failed to cache a pattern")
+        tree = [A(v=1), A(v=-3, w=2), A(v=4), B(v=A(v=2))]
+        self.assertEqual([x.capture['a'] for x in m.match(tree)], [tree[0], tree[1], tree[3].v], "Failed to match a text pattern")
+        code = ast.parse("os.path.join(a, b)\nprint(x)")
+        m = dsl.compile("Capture(c, Type(ast.Call, Attrs(Attr(func, Type(ast.Attribute)), strict=False)))", {'ast': ast})
+        self.assertEqual(len(m.match(code)), 1, "Failed to match dotted types")
+        m = dsl.compile("Capture(c, Type(Call, Attrs(Attr(func, Type(Name)), strict=False)))", ast)
+        self.assertEqual(len(m.match(code)), 1, "Failed to use a module as namespace")
+        for bad in ["__import__('os')", "Type(A).x", "Type(A.__class__)", "Hook(eval, AnyValue())", "Type(Unknown)", "Type(A, **x)", "1 + 2", "'x'"]:
+            with self.assertRaises(ValueError, msg="Failed to refuse %r" % bad):
+                dsl.parse(bad, ns)
+        with self.assertRaises(SyntaxError, msg="Failed to refuse a syntax error"):
+            dsl.parse("Type(", ns)
+        dsl.purge()
+        old = dsl._MAXCACHE
+        dsl._MAXCACHE = 2
+        try:
+            first = dsl.compile("Type(int)")
+            dsl.compile("Type(str)")
+            dsl.compile("Type(int)")
+            dsl.compile("Type(float)")
+            self.assertIs(dsl.compile("Type(int)"), first, "Failed to keep the recent patterns")
+            self.assertEqual(len(dsl._cache), 2, "Failed to bound the cache")
+        finally:
+            dsl._MAXCACHE = old
+            dsl.purge()
+
+    def test_34(self):
+        """
+        Command line
+        """
+        import io
+        import json
+        import tempfile
+        import os
+        from treematching.__main__ import main
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, 'a.py'), 'w') as f:
+                f.write("import os\nprint(os.getcwd())\nlen(x)\n")
+            os.mkdir(os.path.join(d, 'sub'))
+            with open(os.path.join(d, 'sub', 'b.json'), 'w') as f:
+                json.dump({'items': [{'id': 1}, {'id': 'x'}]}, f)
+            with open(os.path.join(d, 'sub', 'c.jsonl'), 'w') as f:
+                f.write('{"id": 2}\n\n{"name": "y"}\n{"id": 3}\n')
+            open(os.path.join(d, 'empty.py'), 'w').close()
+            out = io.StringIO()
+            res = main(["Capture(c, Type(Call, Attrs(Attr(func, Type(Name)), strict=False)))", d, '-j', '1'], out)
+            recs = [json.loads(l) for l in out.getvalue().splitlines()]
+            self.assertEqual(res, 0, "Failed to find matches")
+            self.assertEqual([r['captures']['c']['source'] for r in recs], ['print(os.getcwd())', 'len(x)'], "Failed to match python files")
+            self.assertEqual(recs[0]['path'], ['body', 1, 'value'], "Failed to give the path")
+            out = io.StringIO()
+            res = main(["Capture(d, Type(dict, Dict(Key(id, Type(int)))))", os.path.join(d, 'sub'), '-j', '2'], out)
+            recs = [json.loads(l) for l in out.getvalue().splitlines()]
+            self.assertEqual([(os.path.basename(r['file']), r.get('line'), r['captures']['d']) for r in recs],
+                             [('b.json', None, {'id': 1}), ('c.jsonl', 1, {'id': 2}), ('c.jsonl', 4, {'id': 3})], "Failed to match json files")
+            self.assertEqual(recs[0]['path'], ['items', 0], "Failed to give the path")
+            out = io.StringIO()
+            main(["Type(int)", d, '-j', '1', '--max-count', '2'], out)
+            self.assertEqual(len(out.getvalue().splitlines()), 2, "Failed to stop after max-count")
+            self.assertEqual(main(["Type(bytes)", d, '-j', '1'], io.StringIO()), 1, "Failed to report no match")
+            # a file too deep is an error of its own, the run goes on
+            with open(os.path.join(d, 'sub', 'deep.json'), 'w') as f:
+                f.write('[' * 3000 + ']' * 3000)
+            from treematching.__main__ import records, submitted
+            self.assertIn('error', records(None, os.path.join(d, 'sub', 'deep.json'))[0], "Failed to catch the recursion")
+            out = io.StringIO()
+            main(["Capture(d, Type(dict, Dict(Key(id, Type(int)))))", os.path.join(d, 'sub'), '-j', '2'], out)
+            self.assertEqual(len(out.getvalue().splitlines()), 3, "Failed to go on after a deep file")
+            # bounded submission, in order
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(2) as pool:
+                self.assertEqual(list(submitted(pool, abs, range(-10, 0), 3)), list(range(10, 0, -1)), "Failed to keep the order")
+
+    def test_35(self):
+        """
+        Result cache
+        """
+        import io
+        import json
+        import tempfile
+        import os
+        from treematching.__main__ import main, load_pattern
+        from treematching.cache import ResultCache, fingerprint, digest
+        pattern = "Capture(c, Type(Call, Attrs(Attr(func, Type(Name)), strict=False)))"
+        fp = fingerprint(load_pattern(pattern, ['ast']))
+        self.assertEqual(fp, fingerprint(load_pattern(pattern, ['ast'])), "Failed to give a stable fingerprint")
+        self.assertNotEqual(fp, fingerprint(load_pattern("Type(Call)", ['ast'])), "Failed to distinguish patterns")
+        self.assertNotEqual(fingerprint(Hook(Type(A), lambda c, u: 1)), fingerprint(Hook(Type(A), lambda c, u: 2)), "Failed to distinguish hooks")
+        # the values read by a hook are part of it
+        def bounded(limit):
+            return Hook(lambda c, u: c['x'] > limit, Capture('x', Type(int)))
+        self.assertEqual(fingerprint(bounded(1)), fingerprint(bounded(1)), "Failed to give a stable fingerprint")
+        self.assertNotEqual(fingerprint(bounded(1)), fingerprint(bounded(2)), "Failed to fingerprint the closure")
+        before = fingerprint(Hook(_hook_limit, Type(int)))
+        global HOOK_LIMIT
+        HOOK_LIMIT, old = HOOK_LIMIT + 1, HOOK_LIMIT
+        try:
+            self.assertNotEqual(fingerprint(Hook(_hook_limit, Type(int))), before, "Failed to fingerprint the globals")
+        finally:
+            HOOK_LIMIT = old
+        with tempfile.TemporaryDirectory() as d, tempfile.TemporaryDirectory() as store:
+            src = os.path.join(d, 'a.py')
+            with open(src, 'w') as f:
+                f.write("print(x)\nlen(y)\n")
+            out = io.StringIO()
+            main([pattern, d, '-j', '1', '--cache', store], out)
+            cache = ResultCache(store)
+            with open(src, 'rb') as f:
+                dg = 'py-' + digest(f.read())
+            self.assertEqual(len(cache.get(fp, dg)), 2, "Failed to store the records")
+            # a hit skips the parsing, a bogus entry proves it
+            cache.put(fp, dg, [{'path': ['cached'], 'captures': {}}])
+            out = io.StringIO()
+            main([pattern, d, '-j', '1', '--cache', store], out)
+            self.assertEqual(json.loads(out.getvalue()), {'file': src, 'path': ['cached'], 'captures': {}}, "Failed to use the cache")
+            with open(src, 'w') as f:
+                f.write("print(x)\nlen(y)\n")
+            # rewritten but unchanged, still a hit
+            out = io.StringIO()
+            main([pattern, d, '-j', '2', '--cache', store], out)
+            self.assertEqual(json.loads(out.getvalue())['path'], ['cached'], "Failed to key by content")
+            with open(src, 'a') as f:
+                f.write("str(z)\n")
+            out = io.StringIO()
+            main([pattern, d, '-j', '2', '--cache', store], out)
+            self.assertEqual(len(out.getvalue().splitlines()), 3, "Failed to miss on a changed file")
+            # size bound, the least recently used is evicted
+            small = ResultCache(os.path.join(store, 'small'), 100)
+            for i in range(5):
+                small.put(fp, 'd%d' % i, [{'path': [i], 'captures': {'c': 'x' * 20}}])
+                os.utime(small.filename(fp, 'd%d' % i), (i, i))
+            self.assertTrue(sum(e[1] for e in small.entries()) <= 100, "Failed to bound the size")
+            self.assertIsNone(small.get(fp, 'd0'), "Failed to evict the oldest")
+            self.assertIsNotNone(small.get(fp, 'd4'), "Failed to keep the newest")
+        # the same bytes parsed as python, json and json lines
+        with tempfile.TemporaryDirectory() as d, tempfile.TemporaryDirectory() as store:
+            for name in ('a.json', 'b.py', 'c.jsonl'):
+                with open(os.path.join(d, name), 'w') as f:
+                    f.write("[1]\n")
+            for _ in range(2):
+                out = io.StringIO()
+                main(["Capture(c, Type(Module))", d, '-j', '1', '--cache', store], out)
+                found = sorted(os.path.basename(json.loads(l)['file']) for l in out.getvalue().splitlines())
+                self.assertEqual(found, ["b.py"], "Failed to key by the kind of file")
+
+    def test_36(self):
+        """
+        count and exists keep nothing
+        """
+        from treematching.analysis import uncaptured, items
+        bt = Capture('a', Type(A, Attrs(Attr('v', Capture('v', Type(int))), strict=False)))
+        tree = [A(v=1), B(v=A(v=2)), A(v='x'), [A(v=3, w=A(v=4))]]
+        e = MatchingBTree(bt)
+        self.assertEqual(e.count(tree), len(e.match(tree)), "Failed to count the matches")
+        self.assertEqual(e.count(tree), 4, "Failed to count the matches")
+        self.assertTrue(e.exists(tree), "Failed to find a match")
+        self.assertFalse(e.exists([A(v='x'), B()]), "Failed to find no match")
+        self.assertFalse([i for i in items(e._uncaptured) if isinstance(i, Capture)], "Failed to strip the captures")
+        self.assertIsInstance(bt.second.second.subs[0].second, Capture, "Failed to keep the pattern")
+        # exists stop at the first success
+        res = MatchRun(e, retain=False, limit=1)
+        res.feed_all(e.events(tree))
+        self.assertEqual((res.result.events, len(res.glist)), (5, 0), "Failed to stop at the first match")
+        self.assertEqual((len(res.result), res.result.matched), (0, 1), "Failed to keep nothing")
+        # hooks read the captures, they are kept
+        seen = []
+        bt = Hook(lambda c, u: seen.append(c['a']), Capture('a', Type(A)))
+        self.assertIs(uncaptured(bt), bt, "Failed to keep the captures for a Hook")
+        self.assertEqual(MatchingBTree(bt).count(tree), 5, "Failed to count with a Hook")
+        self.assertEqual(len(seen), 5, "Failed to call the Hook")
+
+    def test_37(self):
+        """
+        Overlap policies
+        """
+        inner = A(v=A(v=1))
+        tree = [A(v=inner), B(v=A(v=2)), [A(v='x')]]
+        e = MatchingBTree(Capture('a', Type(A)))
+        res = e.match(tree, overlap=Overlap.OUTERMOST)
+        self.assertEqual([m.capture['a'] for m in res], [tree[0], tree[1].v, tree[2][0]], "Failed to keep the outermost")
+        res = e.match(tree, overlap=Overlap.INNERMOST)
+        self.assertEqual([m.capture['a'] for m in res], [inner.v, tree[1].v, tree[2][0]], "Failed to keep the innermost")
+        self.assertEqual(len(e.match(tree, overlap=Overlap.NONOVERLAPPING)), 5, "Failed to keep disjoint matches")
+        self.assertEqual(e.count(tree, overlap=Overlap.OUTERMOST), 3, "Failed to count the outermost")
+        # the matches share the events of inner
+        e = MatchingBTree(Capture('a', Type(A, Attrs(Attr('v', Type(A)), strict=False))))
+        full = e.match(tree)
+        self.assertEqual([m.capture['a'] for m in full], [inner, tree[0]], "Failed to match")
+        for overlap, want in ((Overlap.NONOVERLAPPING, inner), (Overlap.INNERMOST, inner), (Overlap.OUTERMOST, tree[0])):
+            res = e.match(tree, overlap=overlap)
+            self.assertEqual([m.capture['a'] for m in res], [want], "Failed to apply %s" % overlap.name)
+        # the dominated contexts are killed
+        res = e.match(tree, overlap=Overlap.INNERMOST)
+        self.assertEqual(res.pruned, 1, "Failed to prune the outer contexts")
+        self.assertTrue(res.ticks < full.ticks, "Failed to save ticks")
+        # the matches given during the walk can't be taken back
+        async def outermost():
+            return [m async for m in e.aiter_match(tree, overlap=Overlap.OUTERMOST)]
+        with self.assertRaises(ValueError):
+            asyncio.run(outermost())
+        with self.assertRaises(ValueError):
+            MatchingForest({'a': e.bt}).match(tree, overlap=Overlap.OUTERMOST)
+        self.assertEqual(len(MatchingForest({'a': e.bt}).match(tree, overlap=Overlap.INNERMOST)), 1, "Failed to apply INNERMOST")
+
+    def test_38(self):
+        """
+        Eviction of live contexts
+        """
+        tree = [A(v=[B(v=1), B(v=[2, 3])]), C(v=B(v=3)), A(v=[1, 2, 3, 4])]
+        # a not strict Ancestor keeps its contexts running
+        e = MatchingBTree(Ancestor(Type(C), AnyType(), strict=False))
+        full = e.match(tree)
+        self.assertGreater(full.contexts, 5, "Failed to keep contexts running")
+        for evict in (Eviction.OLDEST, Eviction.DEEPEST):
+            match = e.match(tree, max_contexts=5, evict=evict)
+            self.assertIsNone(match.exceeded, "Failed to go on with %s" % evict.name)
+            self.assertEqual(match.contexts, 5, "Failed to bound the contexts with %s" % evict.name)
+            self.assertGreater(match.dropped, 0, "Failed to count the dropped contexts")
+            self.assertEqual([m.uid for m in match], [m.uid for m in full], "Failed to keep the young contexts")
+        match = e.match(tree, max_contexts=5, evict=Eviction.REFUSE)
+        self.assertEqual((len(match), match.contexts, match.events), (0, 5, full.events), "Failed to refuse new contexts")
+        self.assertEqual(match.dropped, 24, "Failed to count the refused contexts")
+        with self.assertRaises(ContextsExceeded) as cm:
+            e.match(tree, max_contexts=5, evict=Eviction.ABORT)
+        self.assertEqual(cm.exception.result.exceeded, 'max_contexts', "Failed to give the partial result")
+        match = e.match(tree, max_contexts=5)
+        self.assertEqual((match.exceeded, match.dropped), ('max_contexts', 0), "Failed to stop by default")
+        for evict in Eviction:
+            with self.assertRaises(ValueError):
+                e.match(tree, max_contexts=0, evict=evict)
+
+    def test_39(self):
+        """
+        MatchSession fed by the producer
+        """
+        e = MatchingBTree(Capture('a', Type(A, Attrs(Attr('v', Type(int))))))
+        tree = [A(v=1), B(v=A(v=2)), A(v='x')]
+        session = e.session()
+        found = []
+        for it in walk(tree):
+            for m in session.feed(it):
+                found.append((it[Pos.TYPE], m.capture['a'].v))
+        self.assertEqual(found, [('type', 1), ('type', 2)], "Failed to give the matches at once")
+        res = session.close()
+        self.assertEqual([m.capture['a'].v for m in res], [1, 2], "Failed to give the result")
+        self.assertEqual(res.events, len(list(walk(tree))), "Failed to count the events")
+        # next document, events without Path
+        res = session.feed_many(it[:Pos.PATH] for it in walk([B(v=A(v=3))]))
+        self.assertEqual([m.capture['a'].v for m in res], [3], "Failed to reuse the session")
+        self.assertEqual(session.result.events, len(list(walk([B(v=A(v=3))]))), "Failed to start a new document")
+        session.close()
+        # the order of the walk is checked
+        events = list(walk([A(v=1)]))
+        with self.assertRaises(ValueError):
+            session.feed_many(reversed(events))
+        session.close()
+        with self.assertRaises(ValueError):
+            session.feed_many(events + events[-1:])
+        session.close()
+        with self.assertRaises(ValueError):
+            session.feed(('enter', None, 0, [(0, 0)]))
+        with self.assertRaises(ValueError):
+            e.session(overlap=Overlap.OUTERMOST)
+        # nothing is fed once the run stopped
+        session = e.session(limit=1)
+        self.assertEqual(len(session.feed_many(walk([A(v=1), A(v=2), A(v=3)]))), 1, "Failed to stop at the limit")
+        self.assertEqual(len(session.close()), 1, "Failed to stop at the limit")
+        # the names of a node are sorted, like in walk
+        e = MatchingBTree(Type(A, Attrs(Attr('a', Type(int)), Attr('b', Type(int)))))
+        events = [it[:Pos.PATH] for it in walk(A(a=1, b=2))]
+        session = e.session()
+        self.assertEqual(len(session.feed_many(events)), 1, "Failed to match sorted names")
+        session.close()
+        with self.assertRaises(ValueError):
+            session.feed_many(events[3:6] + events[:3] + events[6:])
+
+    def test_40(self):
+        """
+        XML source
+        """
+        import io
+        import gc
+        import weakref
+        from treematching import xmlsource
+        xml = b'<root v="1"><a x="1">hello<b/><b z="3">t</b></a><c/> <a/></root>'
+        events = list(xmlsource.events(io.BytesIO(xml)))
+        root = events[-1][Pos.ARG]
+        a, b = xmlsource.tag_class('a'), xmlsource.tag_class('b')
+        self.assertIs(type(root[0]), a, "Failed to give the class of the tag")
+        self.assertEqual((root.v, root[0].x, vars(root[0])['#text'], len(root[0])), ('1', '1', 'hello', 2), "Failed to build the nodes")
+        walked = list(walk(root))
+        self.assertEqual([e[:Pos.ARG] + e[Pos.ARG + 1:Pos.PATH] for e in events],
+                         [e[:Pos.ARG] + e[Pos.ARG + 1:Pos.PATH] for e in walked], "Failed to give the events of walk")
+        bt = Capture('b', Type(b, Attrs(Attr('z', Type(str)), strict=False)))
+        match = xmlsource.match(MatchingBTree(bt), io.BytesIO(xml), path=True)
+        self.assertEqual([(m.capture['b'].z, m.path.keys()) for m in match], [('3', [0, 1])], "Failed to match XML")
+        # only what can be captured is kept
+        events = list(xmlsource.events(io.BytesIO(xml), bt))
+        self.assertEqual(events[-1][Pos.TYPE], 'type', "Failed to end on the root")
+        self.assertEqual(len(events[-1][Pos.ARG]), 0, "Failed to drop the root children")
+        self.assertIn(('list', range(3)), [e[:2] for e in events], "Failed to count the children")
+        self.assertEqual(len([e for e in events if e[Pos.TYPE] == 'type' and type(e[Pos.ARG]) is a and len(e[Pos.ARG])]), 0, "Failed to drop the children")
+        # the ended records are released
+        xml = b'<export>' + b''.join(b'<rec id="%d"><p>%d</p></rec>' % (i, i) for i in range(200)) + b'</export>'
+        rec = xmlsource.tag_class('rec')
+        refs = []
+        for e in xmlsource.events(io.BytesIO(xml), Capture('p', Type(xmlsource.tag_class('p')))):
+            if e[Pos.TYPE] == 'type' and type(e[Pos.ARG]) is rec:
+                refs.append(weakref.ref(e[Pos.ARG]))
+            del e
+        gc.collect()
+        self.assertEqual(len(refs), 200, "Failed to walk the records")
+        self.assertEqual([r for r in refs if r() is not None], [], "Failed to release the records")
@@ -0,0 +1,234 @@
+"""
+    treegrep...
+
+    Match a pattern over python sources and JSON files...
+
+    python -m treematching [options] PATTERN PATH...
+
+    PATTERN is a text pattern (see dsl) or a module:attribute reference to a
+    pattern or a MatchingBTree. Each match is printed as a JSON line with the
+    file, the path from the root of the tree and the captures.
+"""
+
+import os
+import sys
+import ast
+import json
+import mmap
+import argparse
+import importlib
+import itertools
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from treematching import dsl
+from treematching import serialize
+from treematching.cache import ResultCache, fingerprint, digest
+from treematching.btitems import BTItem
+from treematching.matchingbtree import MatchingBTree
+
+SUFFIXES = ('.py', '.json', '.jsonl')
+
+# matcher and result cache of the worker process
+_matcher = None
+_cache = None
+_fp = None
+
+def load_pattern(text, namespaces=()) -> MatchingBTree:
+    """
+    MatchingBTree of a text pattern or of a module:attribute reference
+    """
+    ref = text.strip()
+    if ':' in ref and '(' not in ref:
+        modname, attr = ref.split(':', 1)
+        obj = importlib.import_module(modname)
+        for name in attr.split('.'):
+            obj = getattr(obj, name)
+        if isinstance(obj, BTItem):
+            obj = MatchingBTree(obj, ref)
+        if not isinstance(obj, MatchingBTree):
+            raise ValueError("%s is not a pattern" % ref)
+        return obj
+    namespace = {}
+    for modname in namespaces:
+        namespace.update(vars(importlib.import_module(modname)))
+    return dsl.compile(text, namespace, 'pattern')
+
+def files(paths) -> object:
+    """
+    Files to match, directories are walked
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                for name in sorted(names):
+                    if name.endswith(SUFFIXES):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def trees(filename) -> object:
+    """
+    (line, tree) of a file, read thru mmap
+    """
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from parse(filename, mm)
+
+def kind(filename) -> str:
+    """
+    How a file is parsed: 'jsonl', 'json' or 'py'
+    """
+    if filename.endswith('.jsonl'):
+        return 'jsonl'
+    if filename.endswith('.json'):
+        return 'json'
+    return 'py'
+
+def parse(filename, mm) -> object:
+    k = kind(filename)
+    if k == 'jsonl':
+        # one document per line, never the whole file
+        mm.seek(0)
+        for lineno, line in enumerate(iter(mm.readline, b''), 1):
+            if line.strip():
+                yield lineno, json.loads(line)
+    elif k == 'json':
+        yield None, json.loads(mm[:])
+    else:
+        yield None, ast.parse(mm, filename)
+
+def jsonable(obj) -> object:
+    """
+    Serializable form of a capture
+    """
+    if isinstance(obj, ast.AST):
+        res = {'ast': type(obj).__name__, 'source': ast.unparse(obj)}
+        if hasattr(obj, 'lineno'):
+            res['lineno'] = obj.lineno
+        return res
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, (list, tuple)):
+        return [jsonable(v) for v in obj]
+    if isinstance(obj, dict) and all(isinstance(k, str) for k in obj):
+        return {k: jsonable(v) for k, v in obj.items()}
+    return repr(obj)
+
+def matches(matcher, filename, trees) -> list:
+    res = []
+    for lineno, tree in trees:
+        for m in matcher.match(tree, path=True):
+            rec = {'file': filename}
+            if lineno is not None:
+                rec['line'] = lineno
+            rec['path'] = [jsonable(k) for k in m.path.keys()]
+            rec['captures'] = {k: jsonable(v) for k, v in m.capture.items()}
+            res.append(rec)
+    return res
+
+def records(matcher, filename, cache=None, fp=None) -> list:
+    """
+    Records of the matches in a file
+
+    cache: ResultCache, with fp the fingerprint of the matcher, an unchanged
+    file is neither parsed nor matched. The entry is keyed by the kind of
+    the file too, the same bytes don't give the same trees in .py and .json
+    """
+    try:
+        if cache is None:
+            return matches(matcher, filename, trees(filename))
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                dg = '%s-%s' % (kind(filename), digest(mm))
+                res = cache.get(fp, dg)
+                if res is not None:
+                    for rec in res:
+                        rec['file'] = filename
+                    return res
+                res = matches(matcher, filename, parse(filename, mm))
+        # stored without the filename, the content may move
+        cache.put(fp, dg, [{k: v for k, v in rec.items() if k != 'file'} for rec in res])
+        return res
+    except (OSError, SyntaxError, ValueError, RecursionError) as e:
+        # too deep for the parser or the walk, the other files go on
+        return [{'file': filename, 'error': str(e) or type(e).__name__}]
+
+def _init(data, directory=None, max_size=None, fp=None):
+    global _matcher, _cache, _fp
+    _matcher = serialize.loads(data)
+    if directory is not None:
+        _cache = ResultCache(directory, max_size)
+        _fp = fp
+
+def _records(filename) -> list:
+    return records(_matcher, filename, _cache, _fp)
+
+def submitted(pool, fn, args, window) -> object:
+    """
+    Results of fn over args in order, at most window calls pending, unlike
+    pool.map that submits all of them at once
+    """
+    pending = collections.deque()
+    for arg in args:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(pool.submit(fn, arg))
+    while pending:
+        yield pending.popleft().result()
+
+def main(argv=None, out=None) -> int:
+    out = sys.stdout if out is None else out
+    parser = argparse.ArgumentParser(prog='python -m treematching', description="Match a pattern over python sources and JSON files")
+    parser.add_argument('pattern', help="text pattern or module:attribute")
+    parser.add_argument('paths', nargs='+', help=".py, .json, .jsonl files or directories")
+    parser.add_argument('-n', '--namespace', action='append', default=None,
+                        help="module where the names of a text pattern are looked up (default: ast)")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="number of processes (default: number of CPU)")
+    parser.add_argument('-m', '--max-count', type=int, default=None, help="stop after this number of matches")
+    parser.add_argument('--cache', default=None, metavar='DIR', help="directory of the result cache, reused across runs")
+    parser.add_argument('--cache-size', type=int, default=256 << 20, help="size bound of the result cache in bytes")
+    args = parser.parse_args(argv)
+    matcher = load_pattern(args.pattern, args.namespace or ['ast'])
+    cache = fp = None
+    if args.cache is not None:
+        cache = ResultCache(args.cache, args.cache_size)
+        fp = fingerprint(matcher)
+    count = 0
+    errors = 0
+    jobs = args.jobs or os.cpu_count() or 1
+    pool = None
+    if jobs > 1:
+        pool = ProcessPoolExecutor(jobs, initializer=_init, initargs=(serialize.dumps(matcher), args.cache, args.cache_size, fp))
+        results = submitted(pool, _records, files(args.paths), jobs * 4)
+    else:
+        results = (records(matcher, f, cache, fp) for f in files(args.paths))
+    try:
+        for rec in itertools.chain.from_iterable(results):
+            if 'error' in rec:
+                errors += 1
+                print("%s: %s" % (rec['file'], rec['error']), file=sys.stderr)
+                continue
+            out.write(json.dumps(rec) + '\n')
+            count += 1
+            if args.max_count is not None and count >= args.max_count:
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    out.flush()
+    if count:
+        return 0
+    return 2 if errors else 1
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except BrokenPipeError:
+        # output closed, like by head
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(0)
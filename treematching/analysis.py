@@ -0,0 +1,266 @@
+"""
+    Analysis...
+
+    Static informations computed from a pattern...
+"""
+
+import copy
+from treematching.btitems import *
+
+def children(item) -> list:
+    """
+    Sub-items of a pattern item
+    """
+    res = []
+    for attr in ('subs', 'steps'):
+        for sub in getattr(item, attr, ()):
+            if isinstance(sub, BTItem) and not [r for r in res if r is sub]:
+                res.append(sub)
+    for attr in ('expr', 'first', 'second'):
+        sub = getattr(item, attr, None)
+        if isinstance(sub, BTItem) and not [r for r in res if r is sub]:
+            res.append(sub)
+    return res
+
+def items(bt) -> list:
+    """
+    All the items of a pattern, depth first
+    """
+    res = []
+    todo = [bt]
+    while todo:
+        item = todo.pop()
+        res.append(item)
+        todo.extend(reversed(children(item)))
+    return res
+
+class Projection:
+    """
+    Attribute names and dict keys that a pattern can consume
+
+    None means that all the names must be walked, because the pattern
+    never constrains them or use a wildcard (AnyAttr, AnyKey, Ancestor).
+    anchored: an axis the pattern never names is not walked at all,
+              instead of fully walked
+    """
+    __slots__ = ('attrs', 'keys')
+
+    def __init__(self, bt, anchored=False):
+        attrs = set()
+        keys = set()
+        any_attr = any_key = False
+        for item in items(bt):
+            if isinstance(item, Attr):
+                attrs.add(item.first)
+            elif isinstance(item, AnyAttr):
+                any_attr = True
+            elif isinstance(item, Key):
+                try:
+                    keys.add(item.first)
+                except TypeError:
+                    any_key = True
+            elif isinstance(item, AnyKey):
+                any_key = True
+            elif isinstance(item, Ancestor):
+                # the child could be anywhere under the ancestor
+                any_attr = any_key = True
+        self.attrs = frozenset(attrs) if (attrs or anchored) and not any_attr else None
+        self.keys = frozenset(keys) if (keys or anchored) and not any_key else None
+
+    def __repr__(self) -> str:
+        return "Projection(attrs=%r, keys=%r)" % (self.attrs, self.keys)
+
+def height(bt):
+    """
+    Upper bound of the number of levels between the node of the first event
+    consumed by a pattern and the node where it succeeds
+
+    None when it's not bounded (Sibling, not strict Ancestor, unknown items).
+    """
+    if bt is None:
+        return 0
+    if isinstance(bt, (AnyValue, AnyVector, AnyDict, AnyList)) and not isinstance(bt, Component):
+        return 0
+    if isinstance(bt, (Component, Type, Capture, Hook, Event, Attr, Key, Idx,
+                       AnyAttr, AnyKey, AnyIdx, AnyType, Shared)):
+        hs = [height(sub) for sub in children(bt)]
+        if None in hs:
+            return None
+        h = max(hs) if hs else 0
+        # Attrs, List and Dict end on their owner, one level upper than their subs
+        if isinstance(bt, (Attrs, List, Dict)) and hs:
+            h += 1
+        return h
+    if isinstance(bt, Ancestor):
+        h = height(bt.second)
+        if h is None or not bt.strict:
+            return None
+        return h + bt.depth
+    return None
+
+# attributes computed from the others by the items
+DERIVED = frozenset(('routes', 'routed', 'unrouted', 'route_height', 'kind',
+                     'types', 'kinds', 'mro_cache'))
+
+def positions(item) -> list:
+    """
+    (attribute, sub-item) of each position of a pattern item
+    """
+    res = []
+    for attr in ('subs', 'steps', 'expr', 'first', 'second'):
+        v = getattr(item, attr, None)
+        subs = v if attr in ('subs', 'steps') else (v,)
+        for sub in subs or ():
+            if isinstance(sub, BTItem):
+                res.append((attr, sub))
+    if isinstance(item, Type) and item.steps:
+        # second is also the first step
+        res = [(attr, sub) for attr, sub in res if attr != 'second']
+    return res
+
+def rebuild(item, fn):
+    """
+    Copy of item with each sub-item replaced by fn(sub, attribute),
+    item itself when nothing change
+    """
+    changes = {}
+    for attr in ('subs', 'steps', 'expr', 'first', 'second'):
+        v = getattr(item, attr, None)
+        if isinstance(v, BTItem):
+            nv = fn(v, attr)
+            if nv is not v:
+                changes[attr] = nv
+        elif attr in ('subs', 'steps') and v:
+            nv = [fn(sub, attr) if isinstance(sub, BTItem) else sub for sub in v]
+            if [a for a, b in zip(nv, v) if a is not b]:
+                changes[attr] = type(v)(nv)
+    if not changes:
+        return item
+    res = copy.copy(item)
+    for attr, v in changes.items():
+        setattr(res, attr, v)
+    return res
+
+def _value_key(v):
+    if isinstance(v, BTItem):
+        # sub-items are already interned
+        return ('item', id(v))
+    if isinstance(v, (list, tuple)):
+        return ('seq', tuple(_value_key(x) for x in v))
+    try:
+        hash(v)
+    except TypeError:
+        return ('id', id(v))
+    return (type(v), v)
+
+def structure(item) -> tuple:
+    """
+    Hashable key of an item, equal for structurally equal items
+    """
+    attrs = sorted((k, _value_key(v)) for k, v in vars(item).items() if k not in DERIVED)
+    return (type(item), tuple(attrs))
+
+def intern(bt, table=None):
+    """
+    Hash-consing of a pattern, structurally equal sub-patterns
+    become the same object, shared with the patterns already in table
+    """
+    table = {} if table is None else table
+    memo = {}
+    def canon(item, attr=None):
+        if id(item) not in memo:
+            new = rebuild(item, canon)
+            memo[id(item)] = table.setdefault(structure(new), new)
+        return memo[id(item)]
+    return canon(bt)
+
+def regular(item, attr) -> bool:
+    """
+    A sub-item ticked on each event from its start until its end
+
+    Ancestor tick its first even when failed, Type with three steps tick
+    the two first steps concurrently.
+    """
+    if isinstance(item, Ancestor):
+        return attr == 'second'
+    if isinstance(item, Type) and len(item.steps) >= 3:
+        return False
+    return True
+
+def pure(bt) -> bool:
+    """
+    A sub-pattern without side effects, made of the items of the module
+    """
+    for item in items(bt):
+        if isinstance(item, (Capture, Hook, Event)):
+            return False
+        if type(item).__module__ != BTItem.__module__:
+            return False
+    return True
+
+def uncaptured(bt) -> BTItem:
+    """
+    Pattern without its Capture, for the matchings that keep no capture,
+    the pattern itself when a Hook may read them
+    """
+    if not [item for item in items(bt) if type(item) is Capture]:
+        return bt
+    if [item for item in items(bt) if isinstance(item, Hook)]:
+        return bt
+    memo = {}
+    def strip(item, attr=None):
+        if id(item) not in memo:
+            res = item
+            while type(res) is Capture:
+                res = res.second
+            memo[id(item)] = rebuild(res, strip)
+        return memo[id(item)]
+    return strip(bt)
+
+def captured(bt) -> frozenset:
+    """
+    Types of the objects a pattern can capture, None when it can capture
+    anything, like with Capture(name, AnyType())
+    """
+    res = set()
+    for item in items(bt):
+        if not isinstance(item, Capture):
+            continue
+        sub = item.second
+        while isinstance(sub, Shared):
+            sub = sub.expr
+        if not isinstance(sub, Type) or not isinstance(sub.first, type):
+            return None
+        res.add(sub.first)
+    return frozenset(res)
+
+def share(bts) -> list:
+    """
+    Intern the patterns together and wrap the sub-patterns used at least
+    twice by a Shared, computed once per start event by a MatchingForest
+    """
+    table = {}
+    roots = [intern(bt, table) for bt in bts]
+    counts = {}
+    def count(item, reg):
+        for attr, sub in positions(item):
+            sreg = reg and regular(item, attr)
+            if sreg:
+                counts[id(sub)] = counts.get(id(sub), 0) + 1
+            count(sub, sreg)
+    for root in roots:
+        count(root, True)
+    shared = {}
+    memo = {}
+    def wrap(item, reg):
+        if (id(item), reg) not in memo:
+            def fn(sub, attr):
+                sreg = reg and regular(item, attr)
+                new = wrap(sub, sreg)
+                if (sreg and counts.get(id(sub), 0) >= 2
+                        and children(sub) and pure(sub)):
+                    new = shared.setdefault(id(sub), Shared(new))
+                return new
+            memo[(id(item), reg)] = rebuild(item, fn)
+        return memo[(id(item), reg)]
+    return [wrap(root, True) for root in roots]
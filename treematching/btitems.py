@@ -4,6 +4,8 @@
     All what you need to construct your patterns...
 """
 
+import re
+import abc
 from treematching.matchcontext import *
 from treematching.conditions import Condition
 from treematching.debug import *
@@ -51,6 +53,72 @@ class Component(BTItem):
     def __init__(self, *subs):
         self.subs = subs
 
+    def init_routes(self, cls, kind):
+        """
+            index the subs that can only succeed under one name
+
+            routes: name -> [(index of the sub, height of its sub-pattern)]
+        """
+        from treematching.analysis import height
+        self.kind = kind
+        self.routes = {}
+        self.routed = set()
+        self.unrouted = set()
+        self.route_height = 0
+        for idx, sub in enumerate(self.subs):
+            h = height(sub.second) if isinstance(sub, cls) else None
+            try:
+                hash(sub.first)
+            except (TypeError, AttributeError):
+                h = None
+            if h is None:
+                self.unrouted.add(idx)
+                continue
+            self.routes.setdefault(sub.first, []).append((idx, h))
+            self.routed.add(idx)
+            self.route_height = max(self.route_height, h)
+
+    def route(self, data) -> set:
+        """
+            subs that can start on this event, None when all can
+        """
+        if not getattr(self, 'routed', None) or len(data) <= Pos.PATH or data[Pos.PATH] is None:
+            return None
+        # a sub Attr/Key can only succeed on the branch of its name,
+        # an ancestor of the event within the height of its sub-pattern
+        res = set()
+        cell = data[Pos.PATH]
+        lvl = 0
+        while cell is not None and lvl <= self.route_height:
+            if cell.kind == self.kind:
+                for idx, h in self.routes.get(cell.key, ()):
+                    if lvl <= h:
+                        res.add(idx)
+            cell = cell.parent
+            lvl += 1
+        return res
+
+    def passed(self, data, ctx) -> bool:
+        """
+            names are walked in sorted order (walk, xmlsource, checked by
+            MatchSession), once the branch of a routed sub is passed without
+            its success, the component can't succeed
+        """
+        if not getattr(self, 'routed', None) or data[Pos.TYPE] != self.kind:
+            return False
+        if not hasattr(ctx, 'uid') or data[Pos.UID][:-1] != ctx.uid:
+            return False
+        for name, subs in self.routes.items():
+            try:
+                if name > data[Pos.ARG]:
+                    continue
+            except TypeError:
+                continue
+            for idx, h in subs:
+                if idx not in ctx.done:
+                    return True
+        return False
+
     def do_template(self, t, data, ctx, user_data):
         ctx.init_state(self)
         # to be notifying by subs
@@ -62,7 +130,7 @@ class Component(BTItem):
             ctx.state = t
             ctx.init_subs(self.subs)
         if ctx.state == t:
-            log("COMPONENT %s: [%s]" % (t, data))
+            log("COMPONENT %s:" % t, data)
             # calcul if we have finish
             if t == data[Pos.TYPE] and (not hasattr(ctx, 'uid') or data[Pos.UID] == ctx.uid):
                 log("data[UID]: %s" % data[Pos.UID])
@@ -76,13 +144,26 @@ class Component(BTItem):
                 return ctx.set_res(State.FAILED)
             log("check subs")
             # here // match
-            ctx.nbsuccess = 0
             ctx.nbrunning = 0
-            for sub_bt, sub_ctx in zip(self.subs, ctx.subs):
+            if not hasattr(ctx, 'done'):
+                # subs ticked since their last reset, until they succeed
+                ctx.active = set()
+                ctx.done = set()
+            eligible = self.route(data)
+            if eligible is None:
+                todo = range(len(self.subs))
+            else:
+                # a fresh sub out of its branch would fail, it stay fresh
+                todo = sorted(ctx.active | eligible | self.unrouted)
+            for idx in todo:
+                if idx in ctx.done:
+                    continue
+                sub_bt, sub_ctx = self.subs[idx], ctx.subs[idx]
                 # tick only running BT
                 if sub_ctx.res == State.RUNNING:
                     # deeper function could modify the current ctx.matching
                     res = sub_bt.do(data, sub_ctx, user_data)
+                    ctx.active.add(idx)
                 # count after tick
                 if sub_ctx.res == State.RUNNING:
                     ctx.nbrunning += 1
@@ -95,25 +176,63 @@ class Component(BTItem):
                     if ctx.uid != sub_ctx.uid[:-1]:
                         log("NOT AT THE LEVEL %s ?? %s" % (ctx.uid, sub_ctx.uid[:-1]))
                         sub_ctx.reset_tree()
+                        ctx.active.discard(idx)
                     else:
-                        ctx.nbsuccess += 1
+                        # stay a success until the reset of ctx
+                        ctx.done.add(idx)
+                        ctx.active.discard(idx)
+            ctx.nbsuccess = len(ctx.done)
+            if self.passed(data, ctx):
+                log("BRANCH PASSED")
+                return ctx.set_res(State.FAILED)
             # I don't have finish
             log("CHECK MATCHING %d: %s & nbsuccess %d & nbrunning %d" % (id(ctx), ctx.matching, ctx.nbsuccess, ctx.nbrunning))
             # on a partial match, resync the failed
             if ctx.matching or ctx.nbrunning or ctx.nbsuccess:
                 log("Need TO RESET")
-                for sub_bt, sub_ctx in zip(self.subs, ctx.subs):
+                for idx in list(ctx.active):
+                    sub_ctx = ctx.subs[idx]
                     if sub_ctx.res == State.FAILED:
                         log("RESET %d" % id(sub_ctx))
                         # reset
                         sub_ctx.reset_tree()
+                        ctx.active.discard(idx)
                 return ctx.set_res(State.RUNNING)
             return ctx.set_res(State.FAILED)
 
 ##########
 
+class Shared(Expr):
+    """
+    Sub-pattern shared between patterns, see analysis.share
+
+    With the SharedTable of the run, its context is computed once per start
+    event for all its users. Otherwise it's transparent.
+    """
+    def do(self, data, ctx, user_data) -> State:
+        ctx.init_state(self)
+        table = getattr(ctx.getroot(), 'shared', None)
+        if table is None:
+            ctx.init_second()
+            res = self.expr.do(data, ctx.second, user_data)
+            if hasattr(ctx.second, 'uid'):
+                ctx.uid = ctx.second.uid
+            return ctx.set_res(res)
+        if ctx.state == 'enter':
+            ctx.start = table.event
+            ctx.state = 'shared'
+        rec = table.tick(self, ctx.start, data, user_data)
+        if rec.escaped:
+            ctx.getcomponent().matching = True
+        if rec.uid is not None:
+            ctx.uid = rec.uid
+        return ctx.set_res(rec.res)
+
+##########
+
 class Capture(Pair):
     def do(self, data, ctx, user_data) -> State:
+        ctx.init_state(self)
         root = ctx.getroot()
         root.init_capture()
         ctx.init_second()
@@ -128,6 +247,7 @@ class Capture(Pair):
 
 class Hook(Pair):
     def do(self, data, ctx, user_data) -> State:
+        ctx.init_state(self)
         root = ctx.getroot()
         root.init_capture()
         ctx.init_second()
@@ -142,6 +262,7 @@ class Hook(Pair):
 
 class Event(Pair):
     def do(self, data, ctx, user_data) -> State:
+        ctx.init_state(self)
         root = ctx.getroot()
         root.init_event()
         ctx.init_second()
@@ -154,46 +275,122 @@ class Event(Pair):
 
 ##########
 
-class Any(Component): #!!!!!!!!!!!!!!!!!!!
+# bound of the number of classes in the MRO cache of an Any
+MRO_CACHE_SIZE = 1024
+
+class Any(Component):
+    """
+    Alternatives, the first sub to succeed from the first event
+    """
+    def __init__(self, *subs):
+        Component.__init__(self, *subs)
+        self.init_dispatch()
+
+    def init_dispatch(self):
+        """
+            index the Type/KindOf subs by their type
+
+            types: type -> [(index of the sub, height of the sub)]
+            kinds: same for KindOf, looked up thru the MRO
+        """
+        from treematching.analysis import height, items
+        self.types = {}
+        self.kinds = {}
+        self.mro_cache = {}
+        self.routed = set()
+        self.unrouted = set()
+        self.route_height = 0
+        for idx, sub in enumerate(self.subs):
+            h = height(sub) if isinstance(sub, Type) and isinstance(sub.first, type) else None
+            # virtual subclasses of an ABC are not in the MRO
+            if h is not None and sub.kindof and isinstance(sub.first, abc.ABCMeta):
+                h = None
+            # a Hook or an Event must see all its ticks
+            if h is not None and [it for it in items(sub) if isinstance(it, (Hook, Event))]:
+                h = None
+            if h is None:
+                self.unrouted.add(idx)
+                continue
+            table = self.kinds if sub.kindof else self.types
+            table.setdefault(sub.first, []).append((idx, h))
+            self.routed.add(idx)
+            self.route_height = max(self.route_height, h)
+
+    def __getstate__(self):
+        # the cache could hold classes that can't be serialized
+        state = dict(vars(self))
+        state['mro_cache'] = {}
+        return state
+
+    def kindof(self, t) -> list:
+        """
+            KindOf subs matching the class t, cached by class, the list is
+            complete before it's stored, runs in other threads may share it
+        """
+        res = self.mro_cache.get(t)
+        if res is None:
+            res = []
+            for base in t.__mro__:
+                res.extend(self.kinds.get(base, ()))
+            if len(self.mro_cache) >= MRO_CACHE_SIZE:
+                # generated classes are unbounded, start again
+                self.mro_cache.clear()
+            self.mro_cache[t] = res
+        return res
+
+    def route(self, data) -> set:
+        """
+            subs that can start on this event, None when all can
+        """
+        if not self.routed or len(data) <= Pos.PATH or data[Pos.PATH] is None:
+            return None
+        # a sub Type can only succeed on a node of its type,
+        # an ancestor of the event within the height of the sub
+        res = set()
+        cell = data[Pos.PATH]
+        lvl = 0
+        while cell is not None and lvl <= self.route_height:
+            t = type(cell.node)
+            for idx, h in self.types.get(t, ()):
+                if lvl <= h:
+                    res.add(idx)
+            if self.kinds:
+                for idx, h in self.kindof(t):
+                    if lvl <= h:
+                        res.add(idx)
+            cell = cell.parent
+            lvl += 1
+        return res
+
     def do(self, data, ctx, user_data) -> State:
-        #TODO: must be review and found how to don't use it
         ctx.init_state(self)
         if ctx.state == 'enter':
-            log("ANY BEGIN %s" % repr(data))
+            log("ANY BEGIN", data)
             ctx.state = 'final'
-            ctx.init_subs(self.subs)
+            # subs only created when ticked
+            ctx.init_subs(self.subs, lazy=True)
+            # all the subs start on the first event, but the branches of
+            # the types that are not around it, they would fail
+            eligible = self.route(data)
+            if eligible is None:
+                ctx.active = set(range(len(self.subs)))
+            else:
+                ctx.active = eligible | self.unrouted
         if ctx.state == 'final':
-            if hasattr(ctx, 'end') and 'type' == data[Pos.TYPE]:
-                # todo: count subs
-                log("ANY data[UID]: %s" % data[Pos.UID])
-                nbsuccess = 0
-                for sub_ctx in ctx.subs:
-                    if sub_ctx.res == State.SUCCESS:
-                        nbsuccess += 1
-                log("ANY NBSUCCESS %d" % nbsuccess)
-                log("ANY ID %d" % id(ctx))
-                if nbsuccess >= 1:
+            log("LEN SUBS %d ACTIVE %d" % (len(self.subs), len(ctx.active)))
+            # the first sub to succeed, in the order of the subs
+            for idx in sorted(ctx.active):
+                sub_ctx = ctx.sub(idx)
+                res = self.subs[idx].do(data, sub_ctx, user_data)
+                if res == State.SUCCESS:
+                    log("ANY SUCCESS %d" % idx)
                     ctx.uid = data[Pos.UID]
                     return ctx.set_res(State.SUCCESS)
+                if res == State.FAILED:
+                    ctx.active.discard(idx)
+            if not ctx.active:
                 log("ANY FAILED")
                 return ctx.set_res(State.FAILED)
-            # here // match
-            ctx.nbsuccess = 0
-            ctx.nbrunning = 0
-            #ctx.end = 0
-            log("LEN SUBS %d LEN CTX %d" % (len(self.subs), len(ctx.subs)))
-            for sub_bt, sub_ctx in zip(self.subs, ctx.subs):
-                log("SUB CTX: %s" % sub_ctx.res)
-                if sub_ctx.res == State.RUNNING:
-                    res = sub_bt.do(data, sub_ctx, user_data)
-                # count after tick
-                if sub_ctx.res == State.RUNNING:
-                    ctx.nbrunning += 1
-                if sub_ctx.res == State.SUCCESS:
-                    ctx.nbsuccess += 1
-                # if it's failed, we reset it
-                if sub_ctx.res == State.FAILED:
-                    sub_ctx.reset_tree()
         return ctx.set_res(State.RUNNING)
 
 class AnyDict(BTItem):
@@ -211,6 +408,7 @@ class Dict(Component, AnyDict):
     def __init__(self, *subs, strict=True):
         Component.__init__(self, *subs)
         self.strict = strict
+        self.init_routes(Key, 'key')
 
     def do(self, data, ctx, user_data) -> State:
         return self.do_template('dict', data, ctx, user_data)
@@ -321,6 +519,7 @@ class Attrs(Component):
     def __init__(self, *subs, strict=True):
         Component.__init__(self, *subs)
         self.strict = strict
+        self.init_routes(Attr, 'attr')
 
     def do(self, data, ctx, user_data) -> State:
         return self.do_template('attrs', data, ctx, user_data)
@@ -396,6 +595,210 @@ class Value(Expr, AnyValue):
             log("VALUE FAILED")
             return ctx.set_res(State.FAILED)
 
+class ValueCheck(AnyValue):
+    """
+    Match a value that pass the test
+    """
+    def test(self, value) -> bool:
+        return True
+
+    def do(self, data, ctx, user_data) -> State:
+        ctx.init_state(self)
+        log("%s %s" % (type(self).__name__.upper(), ctx.state))
+        if ctx.state == 'enter':
+            if 'value' == data[Pos.TYPE] and self.test(data[Pos.ARG]):
+                log("Match %s" % type(self).__name__)
+                ctx.uid = data[Pos.UID]
+                return ctx.set_res(State.SUCCESS)
+            log("%s FAILED" % type(self).__name__.upper())
+            return ctx.set_res(State.FAILED)
+
+class In(Expr, ValueCheck):
+    """
+    A value in the set expr, one hash lookup
+    """
+    def __init__(self, expr):
+        self.expr = frozenset(expr)
+
+    def test(self, value) -> bool:
+        try:
+            return value in self.expr
+        except TypeError:
+            # unhashable buffers
+            return False
+
+class Range(ValueCheck):
+    """
+    A value in [lo, hi], None for no bound
+    """
+    def __init__(self, lo=None, hi=None):
+        self.lo = lo
+        self.hi = hi
+
+    def test(self, value) -> bool:
+        try:
+            return (self.lo is None or value >= self.lo) and (self.hi is None or value <= self.hi)
+        except TypeError:
+            # not comparable
+            return False
+
+def _view(value):
+    """
+    zero-copy bytes view of a buffer, None for other values, for released
+    views and for strided buffers, they have no bytes view without a copy
+    """
+    try:
+        mv = memoryview(value)
+    except (TypeError, ValueError, BufferError):
+        return None
+    if not mv.c_contiguous:
+        mv.release()
+        return None
+    if mv.format != 'B' or mv.ndim != 1:
+        return mv.cast('B')
+    return mv
+
+class Prefix(Expr, ValueCheck):
+    """
+    A str or buffer that start with expr
+    """
+    def test(self, value) -> bool:
+        if isinstance(value, (str, bytes)):
+            return type(self.expr) is type(value) and value.startswith(self.expr)
+        mv = _view(value)
+        if mv is None or isinstance(self.expr, str):
+            return False
+        with mv:
+            return mv[:len(self.expr)] == self.expr
+
+class Suffix(Expr, ValueCheck):
+    """
+    A str or buffer that end with expr
+    """
+    def test(self, value) -> bool:
+        if isinstance(value, (str, bytes)):
+            return type(self.expr) is type(value) and value.endswith(self.expr)
+        mv = _view(value)
+        if mv is None or isinstance(self.expr, str):
+            return False
+        n = len(self.expr)
+        with mv:
+            return len(mv) >= n and mv[len(mv) - n:] == self.expr
+
+class Length(ValueCheck):
+    """
+    A str or buffer of length in [lo, hi] (bytes for buffers), None for no bound
+    """
+    def __init__(self, lo=None, hi=None):
+        self.lo = lo
+        self.hi = hi
+
+    def test(self, value) -> bool:
+        if isinstance(value, str):
+            n = len(value)
+        else:
+            try:
+                mv = memoryview(value)
+            except (TypeError, ValueError, BufferError):
+                return False
+            with mv:
+                n = mv.nbytes
+        return (self.lo is None or n >= self.lo) and (self.hi is None or n <= self.hi)
+
+class Regex(Expr, ValueCheck):
+    """
+    A str or buffer where the compiled expression is found
+    """
+    def __init__(self, expr):
+        if not isinstance(expr, re.Pattern):
+            expr = re.compile(expr)
+        self.expr = expr
+
+    def test(self, value) -> bool:
+        if isinstance(value, (str, bytes)):
+            try:
+                return self.expr.search(value) is not None
+            except TypeError:
+                return False
+        mv = _view(value)
+        if mv is None or isinstance(self.expr.pattern, str):
+            return False
+        with mv:
+            return self.expr.search(mv) is not None
+
+#####
+
+def _size(vec) -> int:
+    return vec.size if hasattr(vec, 'dtype') else len(vec)
+
+def _min_max(vec) -> tuple:
+    if hasattr(vec, 'dtype'):
+        return vec.min(), vec.max()
+    return min(vec), max(vec)
+
+class AnyVector(BTItem):
+    """
+    Match a numeric vector (array.array, numpy array)
+    """
+    def test(self, vec) -> bool:
+        return True
+
+    def do(self, data, ctx, user_data) -> State:
+        ctx.init_state(self)
+        log("%s %s" % (type(self).__name__.upper(), ctx.state))
+        if ctx.state == 'enter':
+            if 'vector' == data[Pos.TYPE] and self.test(data[Pos.ARG]):
+                log("Match %s" % type(self).__name__)
+                ctx.uid = data[Pos.UID]
+                return ctx.set_res(State.SUCCESS)
+            log("VECTOR FAILED")
+            return ctx.set_res(State.FAILED)
+
+class AllInRange(AnyVector):
+    """
+    All the elements are in [lo, hi], None for no bound
+    """
+    def __init__(self, lo=None, hi=None):
+        self.lo = lo
+        self.hi = hi
+
+    def test(self, vec) -> bool:
+        if not _size(vec):
+            return True
+        vmin, vmax = _min_max(vec)
+        return (self.lo is None or vmin >= self.lo) and (self.hi is None or vmax <= self.hi)
+
+class SomeInRange(AllInRange):
+    """
+    At least one element is in [lo, hi], None for no bound
+    """
+    def test(self, vec) -> bool:
+        if not _size(vec):
+            return False
+        lo, hi = self.lo, self.hi
+        if hasattr(vec, 'dtype'):
+            mask = True
+            if lo is not None:
+                mask = vec >= lo
+            if hi is not None:
+                mask = mask & (vec <= hi)
+            return bool(mask.any()) if hasattr(mask, 'any') else mask
+        if lo is None and hi is None:
+            return True
+        if lo is None:
+            return min(vec) <= hi
+        if hi is None:
+            return max(vec) >= lo
+        # one pass, stopped at the first element in range
+        return any(lo <= x <= hi for x in vec)
+
+class Contains(Expr, AnyVector):
+    """
+    One element is equal to expr
+    """
+    def test(self, vec) -> bool:
+        return bool(self.expr in vec)
+
 #####
 
 class AnyType(Expr):
@@ -597,7 +1000,7 @@ class Sibling(BTItem):
             ctx.state = 'subs'
             ctx.init_subs(self.subs)
         if ctx.state == 'subs':
-            log("COMPONENT [%s]" % repr(data))
+            log("COMPONENT", data)
             # here // match
             ctx.nbsuccess = 0
             ctx.nbrunning = 0
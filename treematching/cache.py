@@ -0,0 +1,200 @@
+"""
+    Cache...
+
+    Content addressed on-disk cache of match records...
+
+    A record list is stored by (pattern fingerprint, input content hash), so an
+    unchanged file is neither parsed nor matched again. The fingerprint of a
+    Hook covers the values its function reads (closure cells, globals),
+    values without a stable repr just never hit. The total size of the
+    store is bounded, the least recently used entries are evicted first.
+"""
+
+import os
+import json
+import hashlib
+import types
+import tempfile
+from treematching import __version__
+from treematching.btitems import BTItem
+from treematching.analysis import DERIVED
+from treematching.matchingbtree import MatchingBTree
+
+# version of the stored records, bumped when their layout change
+VERSION = 1
+SUFFIX = '.json'
+
+def _canon(v, seen=frozenset()) -> object:
+    if isinstance(v, MatchingBTree):
+        return _canon(v.bt, seen)
+    if isinstance(v, BTItem):
+        attrs = sorted((k, _canon(x, seen)) for k, x in vars(v).items() if k not in DERIVED)
+        return (_canon(type(v)), tuple(attrs))
+    if isinstance(v, types.FunctionType):
+        return _canon_function(v, seen)
+    if isinstance(v, (type, types.BuiltinFunctionType)):
+        return '%s.%s' % (v.__module__, v.__qualname__)
+    if isinstance(v, (list, tuple)):
+        return tuple(_canon(x, seen) for x in v)
+    if isinstance(v, (set, frozenset)):
+        # the order of a set change with the hash seed
+        return ('set', tuple(sorted(repr(_canon(x, seen)) for x in v)))
+    if isinstance(v, dict):
+        return ('dict', tuple(sorted(repr((_canon(k, seen), _canon(x, seen))) for k, x in v.items())))
+    return repr(v)
+
+def _canon_code(code) -> tuple:
+    # the repr of a nested code object holds its address
+    consts = tuple(_canon_code(c) if isinstance(c, types.CodeType) else _canon(c) for c in code.co_consts)
+    return (code.co_code, consts, code.co_names)
+
+def _global_names(code) -> set:
+    names = set(code.co_names)
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType):
+            names |= _global_names(c)
+    return names
+
+def _canon_function(f, seen) -> tuple:
+    """
+    a function is its code and the values it reads: defaults, closure
+    cells and the globals it names, like the bound of a lambda
+    """
+    name = '%s.%s' % (f.__module__, f.__qualname__)
+    if f in seen:
+        return ('recursive', name)
+    seen = seen | {f}
+    cells = []
+    for cell in f.__closure__ or ():
+        try:
+            cells.append(_canon(cell.cell_contents, seen))
+        except ValueError:
+            # empty cell
+            cells.append(None)
+    globs = f.__globals__
+    names = sorted(n for n in _global_names(f.__code__) if n in globs)
+    return (name, _canon_code(f.__code__), _canon(f.__defaults__, seen), tuple(cells),
+            tuple((n, _canon(globs[n], seen)) for n in names))
+
+def fingerprint(obj) -> str:
+    """
+    Fingerprint of a pattern or a matcher, stable across processes
+    """
+    h = hashlib.sha256(b'%d:' % VERSION)
+    h.update(repr(_canon(obj)).encode('utf-8'))
+    return h.hexdigest()
+
+def digest(data) -> str:
+    """
+    Hash of the content of an input, any buffer like a mmap, and of the
+    version of the package, the records of another engine are not reused
+    """
+    h = hashlib.sha256(b'%s:' % __version__.encode('ascii'))
+    h.update(data)
+    return h.hexdigest()
+
+class ResultCache:
+    """
+    Records of matches by (fingerprint, digest) in a directory
+
+    max_size: bound in bytes of the store, shared by all the fingerprints
+    """
+    def __init__(self, directory, max_size=256 << 20):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # estimate of the size of the store, scanned on the first put
+        self.size = None
+
+    def filename(self, fp, dg) -> str:
+        return os.path.join(self.directory, fp[:32], dg + SUFFIX)
+
+    def get(self, fp, dg) -> list:
+        """
+        Stored records or None
+        """
+        fn = self.filename(fp, dg)
+        try:
+            with open(fn, 'rb') as f:
+                res = json.loads(f.read())
+            # recently used
+            os.utime(fn)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return res
+
+    def put(self, fp, dg, records):
+        fn = self.filename(fp, dg)
+        data = json.dumps(records, separators=(',', ':')).encode('utf-8')
+        if len(data) > self.max_size:
+            return
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        # atomic, workers of a pool may write the same entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fn), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, fn)
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.entries())
+        else:
+            self.size += len(data)
+        if self.size > self.max_size:
+            self.evict()
+
+    def entries(self) -> object:
+        """
+        (mtime, size, filename) of the stored entries
+        """
+        try:
+            dirs = os.listdir(self.directory)
+        except OSError:
+            return
+        for d in dirs:
+            sub = os.path.join(self.directory, d)
+            try:
+                names = os.listdir(sub)
+            except OSError:
+                continue
+            for name in names:
+                if not name.endswith(SUFFIX):
+                    continue
+                fn = os.path.join(sub, name)
+                try:
+                    st = os.stat(fn)
+                except OSError:
+                    continue
+                yield st.st_mtime, st.st_size, fn
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the store fits
+        """
+        entries = sorted(self.entries())
+        self.size = sum(e[1] for e in entries)
+        for mtime, size, fn in entries:
+            if self.size <= self.max_size:
+                break
+            try:
+                os.unlink(fn)
+            except OSError:
+                # already evicted by another process
+                pass
+            self.size -= size
+
+    def clear(self):
+        for _, _, fn in list(self.entries()):
+            try:
+                os.unlink(fn)
+            except OSError:
+                pass
+        self.size = 0
@@ -1,7 +1,9 @@
 trace = False
+ring = None
 
 import sys
 import json
+import struct
 
 class TreematchEncoder(json.JSONEncoder):
     def __init__(self, *a, **kw):
@@ -11,6 +13,10 @@ class TreematchEncoder(json.JSONEncoder):
     def default(self, obj):
         import treematching.matchcontext as mc
         import treematching.btitems as bt
+        import treematching.match as m
+        if isinstance(obj, m.Match):
+            path = obj.path.keys() if obj.path is not None else None
+            return {'capture': obj.capture, 'uid': obj.uid, 'path': path, 'pattern': obj.pattern}
         if isinstance(obj, mc.MatchContext):
             res = {'id': id(obj), 'parent': id(obj.parent), 'res': repr(obj.res)}
             toremove = ['res', 'parent']
@@ -58,3 +64,84 @@ def log(*t):
 
 def log_json(o):
     log(json.dumps(o, cls=TreematchEncoder))
+
+class TraceRing:
+    """
+    Preallocated ring of fixed size binary records
+
+    Each record is (event index, pattern node id, context id, old state, new state).
+    Only the last `size` records are kept, use treematching.tracedump to read a dump.
+    """
+    MAGIC = b'TMTR'
+    VERSION = 1
+    RECORD = struct.Struct('<QQQBB')
+    HEADER = struct.Struct('<4sBHQQI')
+
+    def __init__(self, size):
+        if size <= 0:
+            raise ValueError("ring size must be positive not %d" % size)
+        self.size = size
+        self.buf = bytearray(size * self.RECORD.size)
+        # number of records written since the creation
+        self.count = 0
+        # index of the event in progress, set by the matching loop
+        self.event = 0
+
+    def record(self, node, ctx, old, new):
+        pos = (self.count % self.size) * self.RECORD.size
+        self.RECORD.pack_into(self.buf, pos, self.event, node, ctx, old, new)
+        self.count += 1
+
+    def records(self) -> bytes:
+        """
+        kept records from the oldest to the newest
+        """
+        rsize = self.RECORD.size
+        if self.count <= self.size:
+            return bytes(self.buf[:self.count * rsize])
+        pos = (self.count % self.size) * rsize
+        return bytes(self.buf[pos:] + self.buf[:pos])
+
+    def dump(self, *bts) -> bytes:
+        """
+        serialize the kept records with the names of the nodes of the patterns bts
+        """
+        import treematching.btitems as bt
+        nodes = {}
+        todo = list(bts)
+        while todo:
+            item = todo.pop()
+            if isinstance(item, bt.BTItem) and id(item) not in nodes:
+                nodes[id(item)] = type(item).__name__
+                for attr in ('subs', 'steps'):
+                    todo.extend(getattr(item, attr, ()))
+                for attr in ('expr', 'first', 'second'):
+                    todo.append(getattr(item, attr, None))
+        table = json.dumps(nodes).encode('utf-8')
+        records = self.records()
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, self.RECORD.size, self.count,
+                                  len(records) // self.RECORD.size, len(table))
+        return header + table + records
+
+    def save(self, filename, *bts):
+        with open(filename, 'wb') as f:
+            f.write(self.dump(*bts))
+
+def ring_on(size=1 << 20):
+    global ring
+    ring = TraceRing(size)
+    return ring
+
+def ring_off():
+    global ring
+    r = ring
+    ring = None
+    return r
+
+def ring_event(idx):
+    if ring is not None:
+        ring.event = idx
+
+def ring_record(ctx, old, new):
+    if ring is not None:
+        ring.record(getattr(ctx, 'item', 0), id(ctx), old, new)
@@ -0,0 +1,111 @@
+"""
+    DSL...
+
+    Textual patterns with the syntax of the constructors of btitems...
+
+    Type(Call, Attrs(Attr(func, Type(Name)), strict=False))
+
+    Only the items, constants, and names are allowed, nothing is evaluated.
+    Bare names are strings as first argument of Attr, Key, Capture and Event,
+    elsewhere they are looked up in the namespace, then in the builtin types.
+"""
+
+import ast
+import builtins
+import threading
+from collections import OrderedDict
+import treematching.btitems as bt
+from treematching.matchingbtree import MatchingBTree
+
+ITEMS = {name: obj for name, obj in vars(bt).items()
+         if isinstance(obj, type) and issubclass(obj, bt.BTItem) and not name.startswith('_')}
+ITEMS['KindOf'] = bt.KindOf
+
+# items whose first argument is a name
+NAMED = {'Attr', 'Key', 'Capture', 'Event'}
+
+# size of the cache of compile, like re
+_MAXCACHE = 512
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+def _lookup(name, namespace):
+    if namespace is not None and name in namespace:
+        return namespace[name]
+    # only the builtin types, hooks must come from the namespace
+    if isinstance(getattr(builtins, name, None), type) and not name.startswith('_'):
+        return getattr(builtins, name)
+    raise ValueError("unknown name %r in pattern" % name)
+
+def _eval(node, namespace, named=False):
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in ITEMS:
+            raise ValueError("unknown item %s in pattern" % ast.unparse(node.func))
+        name = node.func.id
+        args = [_eval(a, namespace, named=(i == 0 and name in NAMED)) for i, a in enumerate(node.args)]
+        kw = {k.arg: _eval(k.value, namespace) for k in node.keywords if k.arg is not None}
+        if len(kw) != len(node.keywords):
+            raise ValueError("unsupported ** in pattern")
+        return ITEMS[name](*args, **kw)
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        if named:
+            return node.id
+        return _lookup(node.id, namespace)
+    if isinstance(node, ast.Attribute):
+        # dotted names, like ast.Call
+        if not isinstance(node.value, (ast.Name, ast.Attribute)) or node.attr.startswith('_'):
+            raise ValueError("unsupported attribute %s in pattern" % node.attr)
+        v = _eval(node.value, namespace)
+        if not hasattr(v, node.attr):
+            raise ValueError("unknown name %s in pattern" % ast.unparse(node))
+        return getattr(v, node.attr)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        v = _eval(node.operand, namespace)
+        if type(v) not in (int, float):
+            raise ValueError("unsupported operand in pattern")
+        return -v if isinstance(node.op, ast.USub) else v
+    if isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+        vs = [_eval(e, namespace) for e in node.elts]
+        return {ast.Tuple: tuple, ast.List: list, ast.Set: frozenset}[type(node)](vs)
+    raise ValueError("unsupported %s in pattern" % type(node).__name__)
+
+def parse(text, namespace=None) -> bt.BTItem:
+    """
+    Pattern of a text
+
+    namespace: dict or module where the types and the hooks are looked up
+    """
+    if namespace is not None and not isinstance(namespace, dict):
+        namespace = vars(namespace)
+    tree = ast.parse(text.strip(), mode='eval')
+    res = _eval(tree.body, namespace)
+    if not isinstance(res, bt.BTItem):
+        raise ValueError("a pattern must be an item")
+    return res
+
+def compile(text, namespace=None, name=None) -> MatchingBTree:
+    """
+    MatchingBTree of a text, cached by text, namespace and name
+    """
+    key = (text, id(namespace), name)
+    with _lock:
+        hit = _cache.get(key)
+        if hit is not None and hit[0] is namespace:
+            _cache.move_to_end(key)
+            return hit[1]
+    matcher = MatchingBTree(parse(text, namespace), name)
+    with _lock:
+        # the namespace is kept alive with its matcher, its id can't be reused
+        _cache[key] = (namespace, matcher)
+        if len(_cache) > _MAXCACHE:
+            _cache.popitem(last=False)
+    return matcher
+
+def purge():
+    """
+    Clear the cache of compile
+    """
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,153 @@
+"""
+    Match...
+
+    Compact result of a successful pattern matching...
+"""
+
+from enum import IntEnum
+
+class Path:
+    """
+    One step of the path from the root of the tree
+
+    Each step only references its parent step, so all the nodes
+    of a subtree share the prefix of their path.
+    """
+    __slots__ = ('parent', 'kind', 'key', 'node')
+
+    def __init__(self, parent, kind, key, node):
+        self.parent = parent
+        # 'key', 'idx' or 'attr', None for the root
+        self.kind = kind
+        self.key = key
+        self.node = node
+
+    def _chain(self) -> list:
+        chain = []
+        curr = self
+        while curr.parent is not None:
+            chain.append(curr)
+            curr = curr.parent
+        chain.reverse()
+        return chain
+
+    def keys(self) -> list:
+        """
+        keys, indexes and attribute names from the root
+        """
+        return [s.key for s in self._chain()]
+
+    def steps(self) -> list:
+        """
+        (kind, key) pairs from the root
+        """
+        return [(s.kind, s.key) for s in self._chain()]
+
+    def nodes(self) -> list:
+        """
+        nodes from the root to this one
+        """
+        nodes = [self.node]
+        curr = self.parent
+        while curr is not None:
+            nodes.append(curr.node)
+            curr = curr.parent
+        nodes.reverse()
+        return nodes
+
+    def __repr__(self) -> str:
+        return "Path(%r)" % self.keys()
+
+class Match:
+    """
+    What remains of a MatchContext once it succeed
+
+    Only the captures, the uid of the node where the match ends,
+    its Path when the walk provide it, the pattern id, the names set by
+    the Event items and the number of Hook modifications are kept, the
+    context tree is released.
+    """
+    __slots__ = ('capture', 'uid', 'path', 'pattern', 'event', 'nb_modif')
+
+    def __init__(self, capture, uid, path=None, pattern=None, event=None, nb_modif=0):
+        self.capture = capture
+        self.uid = uid
+        self.path = path
+        self.pattern = pattern
+        self.event = set() if event is None else event
+        self.nb_modif = nb_modif
+
+    def __repr__(self) -> str:
+        return "Match(capture=%r, uid=%r, path=%r, pattern=%r, event=%r)" % (self.capture, self.uid, self.path, self.pattern, self.event)
+
+class Status(IntEnum):
+    COMPLETE = 0
+    BUDGET_EXCEEDED = 1
+
+class Overlap(IntEnum):
+    """
+    Which matches are kept
+
+    ALL: every match
+    NONOVERLAPPING: matches whose events, from the first event of the
+                    context to its success, are disjoint; the first to
+                    succeed is taken
+    OUTERMOST: matches with no other match on an ancestor node
+    INNERMOST: matches with no other match under their node
+
+    Only the first match of a node is kept by OUTERMOST and INNERMOST.
+    """
+    ALL = 0
+    NONOVERLAPPING = 1
+    OUTERMOST = 2
+    INNERMOST = 3
+
+class Eviction(IntEnum):
+    """
+    What to do when max_contexts live contexts are reached
+
+    STOP: stop the matching, the result has status BUDGET_EXCEEDED
+    OLDEST: drop the context started first
+    DEEPEST: drop the context started deepest in the tree
+    REFUSE: start no new context until some end
+    ABORT: raise ContextsExceeded
+    """
+    STOP = 0
+    OLDEST = 1
+    DEEPEST = 2
+    REFUSE = 3
+    ABORT = 4
+
+class ContextsExceeded(RuntimeError):
+    """
+    Too many live contexts, result is the partial MatchResult
+    """
+    def __init__(self, result):
+        RuntimeError.__init__(self, "%d live contexts reached" % result.contexts)
+        self.result = result
+
+class MatchResult(list):
+    """
+    List of Match with the status of the matching and its counters
+
+    exceeded is the name of the budget that stopped the matching, if any.
+    """
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self.status = Status.COMPLETE
+        self.exceeded = None
+        # counters reached
+        self.matched = 0
+        self.events = 0
+        self.ticks = 0
+        self.contexts = 0
+        self.expired = 0
+        # contexts killed by the overlap policy
+        self.pruned = 0
+        # candidates dropped by the Eviction policy
+        self.dropped = 0
+        self.elapsed = 0.0
+
+    def budget_exceeded(self, name):
+        self.status = Status.BUDGET_EXCEEDED
+        self.exceeded = name
@@ -16,12 +16,19 @@ class Pos(IntEnum):
     TYPE = 0
     ARG = 1
     UID = 3
+    PATH = 4
 
+# attributes that survive a reset_tree
+KEPT = ('parent', 'epoch', 'pepoch', 'first', 'second', 'steps', 'subs', 'idx', 'maxidx')
 
 class MatchContext:
     def __init__(self):
         self.res = State.RUNNING
         self.parent = None
+        # bumped on each reset
+        self.epoch = 0
+        # epoch of the parent when this context was fresh
+        self.pepoch = 0
 
     def getroot(self):
         curr = self
@@ -45,6 +52,7 @@ class MatchContext:
 
     def set_res(self, r):
         log("SET RES %d TO %s" % (id(self), r))
+        ring_record(self, self.res, r)
         self.res = r
         component = self.getcomponent()
         log("SET RES Match %s in upper component %d" % (r, id(component)))
@@ -75,17 +83,35 @@ class MatchContext:
         if not hasattr(self, 'type'):
             log("create type")
             self.type = type(oth).__name__
+            # pattern node id for the trace ring
+            self.item = id(oth)
             self.state = 'enter'
 
+    def adopt(self, child):
+        """
+            connect a child context, fresh for the current epoch
+        """
+        child.parent = self
+        child.pepoch = self.epoch
+        return child
+
+    def refresh(self, child):
+        """
+            a child is stale when its parent was reset after its creation
+        """
+        if child.pepoch != self.epoch:
+            child.reset_tree()
+            child.pepoch = self.epoch
+
     def init_first(self):
         """
             mimic first of Pair
         """
         if not hasattr(self, 'first'):
             log("create first")
-            self.first = MatchContext()
-            # connect to parent
-            self.first.parent = self
+            self.first = self.adopt(MatchContext())
+        else:
+            self.refresh(self.first)
 
     def init_second(self):
         """
@@ -93,9 +119,9 @@ class MatchContext:
         """
         if not hasattr(self, 'second'):
             log("create second")
-            self.second = MatchContext()
-            # connect to parent
-            self.second.parent = self
+            self.second = self.adopt(MatchContext())
+        else:
+            self.refresh(self.second)
 
     def init_steps(self, btitem):
         """
@@ -104,44 +130,97 @@ class MatchContext:
         # use self.steps....
         if not hasattr(self, 'steps'):
             self.steps = []
+        for s in self.steps:
+            self.refresh(s)
         log("LEN steps %s" % len(btitem.steps))
         if len(btitem.steps) >= 1 and len(self.steps) < 1:
             log("steps second")
-            self.steps.append(MatchContext())
-            # connect to parent
-            self.steps[0].parent = self
+            self.steps.append(self.adopt(MatchContext()))
         if len(btitem.steps) >= 2 and len(self.steps) < 2:
             log("steps third")
-            self.steps.append(MatchContext())
-            # connect to parent
-            self.steps[1].parent = self
+            self.steps.append(self.adopt(MatchContext()))
         if len(btitem.steps) >= 3 and len(self.steps) < 3:
             log("steps four")
-            self.steps.append(MatchContext())
-            # connect to parent
-            self.steps[2].parent = self
+            self.steps.append(self.adopt(MatchContext()))
 
-    def init_subs(self, l):
+    def init_subs(self, l, lazy=False):
         """
             mimic subs of Component
+
+            lazy: the subs are created on their first use by sub()
         """
         if not hasattr(self, 'subs'):
             self.idx = 0
             self.maxidx = len(l)
             self.subs = []
             for i in range(self.maxidx):
-                s = MatchContext()
-                # connect to parent
-                s.parent = self
-                self.subs.append(s)
+                self.subs.append(None if lazy else self.adopt(MatchContext()))
+        elif not hasattr(self, 'subs_fresh'):
+            # once per epoch, subs_fresh is dropped by reset_tree
+            for s in self.subs:
+                if s is not None:
+                    self.refresh(s)
+        self.subs_fresh = True
+
+    def sub(self, idx):
+        s = self.subs[idx]
+        if s is None:
+            s = self.subs[idx] = self.adopt(MatchContext())
+        return s
 
     def reset_tree(self):
-        self.state = 'enter'
+        """
+            O(1) reset, the context become fresh and its children stale,
+            they are reset lazily by the init_* on their next tick
+        """
+        d = self.__dict__
+        kept = {k: d[k] for k in KEPT if k in d}
+        d.clear()
+        d.update(kept)
         self.res = State.RUNNING
-        if hasattr(self, 'first'):
-            self.first.reset_tree()
-        if hasattr(self, 'second'):
-            self.second.reset_tree()
-        if hasattr(self, 'subs'):
-            for s in self.subs:
-                s.reset_tree()
+        self.epoch += 1
+
+class SharedTable:
+    """
+    Contexts of the Shared sub-patterns of a run, by (sub-pattern, start event)
+
+    A context is ticked once per event, for all its users. Only the contexts
+    ticked on the previous event can be ticked again, the others are dropped.
+    """
+    def __init__(self):
+        self.event = -1
+        self.current = {}
+        self.previous = {}
+
+    def next_event(self):
+        self.event += 1
+        self.previous = self.current
+        self.current = {}
+
+    def tick(self, item, start, data, user_data):
+        key = (id(item), start)
+        rec = self.current.get(key)
+        if rec is not None:
+            return rec
+        rec = self.previous.get(key)
+        if rec is None:
+            if start != self.event:
+                raise RuntimeError("irregular tick of a Shared pattern")
+            rec = SharedRecord(self)
+        # catch the success that escape the sub-pattern
+        rec.top.matching = False
+        rec.res = item.expr.do(data, rec.ctx, user_data)
+        rec.escaped = rec.top.matching
+        rec.uid = getattr(rec.ctx, 'uid', None)
+        self.current[key] = rec
+        return rec
+
+class SharedRecord:
+    def __init__(self, table):
+        # stand for the component of the users
+        self.top = MatchContext()
+        self.top.shared = table
+        self.ctx = self.top.adopt(MatchContext())
+        self.res = State.RUNNING
+        self.escaped = False
+        self.uid = None
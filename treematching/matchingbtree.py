@@ -4,33 +4,100 @@
     Main module that provide a match object...
 """
 
-import collections as c
+import collections.abc as c
+import time
+import asyncio
+import array
+from concurrent.futures import ThreadPoolExecutor
 from treematching.matchcontext import *
+from treematching.match import *
+from treematching.btitems import Sibling
+from treematching.analysis import Projection, height, items, share, uncaptured
 from treematching.debug import *
 
-def walk(tree, uid=[(0, 0)]) -> object:
+# kinds of the events of walk, the branches carry the uid of the child
+KINDS = frozenset(('key', 'idx', 'attr', 'dict', 'list', 'attrs', 'value', 'vector', 'type'))
+BRANCHES = frozenset(('key', 'idx', 'attr'))
+
+# typecodes of array.array holding numbers
+NUMERIC_TYPECODES = frozenset('bBhHiIlLqQfd')
+
+def is_vector(tree) -> bool:
+    """
+    Homogeneous numeric containers, walked as one leaf
+
+    array.array of numbers and arrays with a numeric dtype (numpy), not
+    their 0-d scalars
+    """
+    if isinstance(tree, array.array):
+        return tree.typecode in NUMERIC_TYPECODES
+    dtype = getattr(tree, 'dtype', None)
+    return getattr(dtype, 'kind', None) in ('b', 'i', 'u', 'f') and getattr(tree, 'ndim', 0) >= 1
+
+# for each type, is it a buffer (bytearray, memoryview, mmap, ...)
+_buffer_types = {str: False, bytes: True, int: False, float: False, bool: False,
+                 list: False, tuple: False, dict: False, type(None): False}
+
+def is_buffer(tree) -> bool:
+    """
+    Objects of the buffer protocol, walked as scalar values
+
+    The answer is cached by type, but for memoryview and arrays with a
+    dtype: a released view or a numpy array of objects has no usable view.
+    A memoryview stays a value without content, the others are walked as
+    other objects.
+    """
+    t = type(tree)
+    res = _buffer_types.get(t)
+    if res is None:
+        try:
+            with memoryview(tree):
+                res = True
+        except TypeError:
+            res = False
+        except (ValueError, BufferError):
+            return t is memoryview
+        if t is not memoryview and not hasattr(t, 'dtype'):
+            _buffer_types[t] = res
+    return res
+
+def walk(tree, uid=[(0, 0)], path=None, proj=None) -> object:
     """
     Bottom-up walker
+
+    When a root Path is given, each event also carry the Path of its node.
+    When a Projection is given, only the attributes and keys it names are walked,
+    nothing under the others is searched.
+    Numeric vectors are not iterated, they give one 'vector' event.
+    Other buffers (bytearray, memoryview, mmap, ...) are scalar values.
     """
     #yield ('enter', None, 0, uid)
     depth, parent = uid[-1]
     nchild = 0
+    if is_vector(tree):
+        yield ('vector', tree, 5, uid, path)
+        yield ('type', tree, 6, uid, path)
+        return
     if isinstance(tree, c.Mapping):
         lsk = list(sorted(tree.keys()))
         len_dict = len(lsk)
         #if len_dict:
         #    yield ('enter_dict', None, 2, uid)
         for k in lsk:
+            if proj is not None and proj.keys is not None and k not in proj.keys:
+                nchild += 1
+                continue
             # value, going depth
             nuid = uid + [(depth + 1, nchild)]
-            yield from walk(tree[k], nuid)
+            npath = Path(path, 'key', k, tree[k]) if path is not None else None
+            yield from walk(tree[k], nuid, npath, proj)
             # key
-            yield ('key', k, 1, nuid)
+            yield ('key', k, 1, nuid, npath)
             nchild += 1
         # dict
         if len_dict:
-            yield ('dict', tree, 2, uid)
-    elif isinstance(tree, c.Iterable) and type(tree) not in {str, bytes}:
+            yield ('dict', tree, 2, uid, path)
+    elif isinstance(tree, c.Iterable) and type(tree) is not str and not is_buffer(tree):
         ls = enumerate(tree)
         len_ls = len(tree)
         #if len_ls:
@@ -38,68 +105,591 @@ def walk(tree, uid=[(0, 0)]) -> object:
         for idx, it in ls:
             # value, going depth
             nuid = uid + [(depth + 1, nchild)]
-            yield from walk(it, nuid)
+            npath = Path(path, 'idx', idx, it) if path is not None else None
+            yield from walk(it, nuid, npath, proj)
             # idx
-            yield ('idx', idx, 1, nuid)
+            yield ('idx', idx, 1, nuid, npath)
             nchild += 1
         # list
         if len_ls:
-            yield ('list', tree, 2, uid)
+            yield ('list', tree, 2, uid, path)
     if hasattr(tree, '__dict__'):
         attrs = vars(tree)
         len_attr = len(attrs)
         #if len_attr:
         #    yield ('enter_attrs', None, 4, uid)
         for k in sorted(attrs.keys()):
+            if proj is not None and proj.attrs is not None and k not in proj.attrs:
+                nchild += 1
+                continue
             # value, going depth
             nuid = uid + [(depth + 1, nchild)]
-            yield from walk(attrs[k], nuid)
+            npath = Path(path, 'attr', k, attrs[k]) if path is not None else None
+            yield from walk(attrs[k], nuid, npath, proj)
             # attr
-            yield ('attr', k, 3, nuid)
+            yield ('attr', k, 3, nuid, npath)
             nchild += 1
         # attrs
         if len_attr:
-            yield ('attrs', attrs, 4, uid)
+            yield ('attrs', attrs, 4, uid, path)
     # value
     # only for scalar
     scalar_type = {int, float, str, bytes, bool}
-    if type(tree) in scalar_type:
-        yield ('value', tree, 5, uid)
+    if type(tree) in scalar_type or is_buffer(tree):
+        yield ('value', tree, 5, uid, path)
     # type
-    yield ('type', tree, 6, uid)
+    yield ('type', tree, 6, uid, path)
 
 class MatchingBTree:
-    def __init__(self, bt):
-        self.state = State.RUNNING
-        self.bt = bt
+    """
+    Compiled matcher, immutable once built
+
+    All the state of a matching lives in its MatchRun, so one MatchingBTree
+    can be used by several threads at once. The only write of a matching to
+    the items of the pattern is the cache by class of Any (kindof), each
+    entry is a complete list stored in one assignment, two threads can only
+    compute the same one. user_data is given to each run and it's up to the
+    Hook to protect it when it's shared. log and the trace ring
+    are global debug tools, not meant to be used from several threads.
+    """
+    __slots__ = ('bt', 'name', '_projection', '_anchored', '_height', '_routed', '_uncaptured')
+
+    def __init__(self, bt, name=None):
+        init = object.__setattr__
+        init(self, 'bt', bt)
+        init(self, 'name', name)
+        # static informations, computed once
+        init(self, '_projection', Projection(bt))
+        init(self, '_anchored', Projection(bt, anchored=True))
+        init(self, '_height', height(bt))
+        # Attrs and Dict route the events by the branch names of the Path
+        init(self, '_routed', any(getattr(item, 'routed', None) for item in items(bt)))
+        # for count and exists
+        init(self, '_uncaptured', uncaptured(bt))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MatchingBTree is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("MatchingBTree is immutable")
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __setstate__(self, state):
+        # restored as is, without analysis
+        for k, v in state.items():
+            object.__setattr__(self, k, v)
 
     def do(self, data, ctx, user_data) -> State:
         log("MatchingBTree")
         return self.bt.do(data, ctx, user_data)
 
-    def match(self, tree, user_data=None):
-        glist = []
-        match = []
-        for idx, it in enumerate(walk(tree)):
-            log(repr(it))
-            log("LEN // %d" % len(glist))
-            glist.append(MatchContext())
-            dlist = []
-            # TODO: idx?
-            for idx, g in enumerate(glist):
-                log("MATCH TEST %d" % idx)
-                r = self.do(it, g, user_data)
-                log("MATCH RES %d %s" % (id(g), repr(r)))
-                if r == State.FAILED:
-                    log("NOMATCH ADD REMOVE: %d" % idx)
-                    dlist.append(g)
-                if r == State.SUCCESS:
-                    log("MATCH ADD REMOVE: %d" % idx)
-                    match.append(g)
-                    dlist.append(g)
-            for d in dlist:
-                log("DO REMOVE: %d" % id(d))
-                glist.remove(d)
-            log("%s\n" % ('-' * 20))
-        return match
+    def projection(self, anchored=False):
+        return self._anchored if anchored else self._projection
+
+    def scope_height(self):
+        return self._height
+
+    def events(self, tree, path=False, project=False, anchored=False):
+        """
+            events of the walk of tree
+        """
+        root = Path(None, None, None, tree) if path or self._routed else None
+        proj = self.projection(anchored) if project or anchored else None
+        return walk(tree, path=root, proj=proj)
+
+    def match(self, tree, user_data=None, path=False, project=False,
+              overlap=Overlap.ALL, anchored=False, **budgets):
+        """
+            path: also give the Path from the root of each match
+            project: only walk the attributes and keys named by the pattern,
+                     matches under other attributes or keys are not searched,
+                     an axis the pattern never names is fully walked
+            anchored: like project, but an axis the pattern never names is
+                      not walked either, the matches are only searched on
+                      the nodes reachable from the root thru the names of
+                      the pattern and the items of the lists
+            overlap: Overlap policy, NONOVERLAPPING and INNERMOST also kill
+                     the live contexts that can't be kept anymore, with
+                     OUTERMOST the inner matches are removed from the result
+
+            Budgets, when one is exceeded the matching stop and the
+            partial result is returned with status BUDGET_EXCEEDED:
+
+            max_events: number of events of the walk
+            max_ticks: number of ticks of the live contexts
+            timeout: wall-clock time in seconds
+            max_contexts: number of live contexts, at least 1
+
+            evict: Eviction policy when max_contexts is reached, STOP by
+                   default, the others go on and count the dropped
+                   candidates, ABORT raises ContextsExceeded
+        """
+        run = MatchRun(self, user_data, path, overlap=overlap, **budgets)
+        run.feed_all(self.events(tree, path, project, anchored))
+        return run.finish()
+
+    def count(self, tree, user_data=None, project=False, overlap=Overlap.ALL, anchored=False, **budgets) -> int:
+        """
+            number of matches, nothing is kept
+
+            The captures are not stored, unless a Hook read them, and a
+            success is counted then released. project, overlap, anchored and
+            budgets are the ones of match.
+        """
+        run = MatchRun(self, user_data, False, retain=False, overlap=overlap, **budgets)
+        run.feed_all(self.events(tree, False, project, anchored))
+        return run.finish().matched
+
+    def exists(self, tree, user_data=None, project=False, anchored=False, **budgets) -> bool:
+        """
+            True on the first match, like count the walk stop there
+        """
+        run = MatchRun(self, user_data, False, retain=False, limit=1, **budgets)
+        run.feed_all(self.events(tree, False, project, anchored))
+        return run.finish().matched > 0
+
+    def session(self, user_data=None, **kw) -> 'MatchSession':
+        """
+            MatchSession fed by an external producer of events
+        """
+        return MatchSession(self, user_data, **kw)
+
+    async def amatch(self, source, user_data=None, path=False, project=False,
+                     every=1000, offload=None, executor=None, anchored=False, **budgets):
+        """
+            asyncio version of match
+
+            source: a tree or an async iterator of events
+            every: give back the control to the loop every `every` events
+            offload: after this number of events, the rest of the walk of
+                     a tree is done in `executor` (None for the default one)
+        """
+        run = MatchRun(self, user_data, path or hasattr(source, '__aiter__'), **budgets)
+        try:
+            if hasattr(source, '__aiter__'):
+                async for it in source:
+                    if not run.feed(it):
+                        break
+                    if run.result.events % every == 0:
+                        await asyncio.sleep(0)
+            else:
+                events = self.events(source, path, project, anchored)
+                for it in events:
+                    if not run.feed(it):
+                        break
+                    if offload is not None and run.result.events >= offload:
+                        loop = asyncio.get_running_loop()
+                        await loop.run_in_executor(executor, run.feed_all, events)
+                        break
+                    if run.result.events % every == 0:
+                        await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            # stop the executor at its next event
+            run.cancel()
+            raise
+        return run.finish()
+
+    async def aiter_match(self, source, user_data=None, path=False, project=False,
+                          every=1000, anchored=False, **budgets):
+        """
+            asyncio iterator on the matches, as soon as they are found
+
+            source: a tree or an async iterator of events
+            every: give back the control to the loop every `every` events
+
+            OUTERMOST is refused, its matches are only known at the end of
+            the walk
+        """
+        if budgets.get('overlap') == Overlap.OUTERMOST:
+            raise ValueError("OUTERMOST matches are only known at the end of the walk")
+        run = MatchRun(self, user_data, path or hasattr(source, '__aiter__'), **budgets)
+        if hasattr(source, '__aiter__'):
+            events = source
+        else:
+            events = _aiter(self.events(source, path, project, anchored))
+        done = 0
+        async for it in events:
+            running = run.feed(it)
+            while done < len(run.result):
+                yield run.result[done]
+                done += 1
+            if not running:
+                break
+            if run.result.events % every == 0:
+                await asyncio.sleep(0)
+        run.finish()
+
+    def match_many(self, trees, user_data=None, max_workers=None, executor=None, **kw) -> list:
+        """
+            match each tree in a thread pool, results are in the order of trees
+
+            executor: an already running executor, else a ThreadPoolExecutor
+                      of max_workers threads is used
+        """
+        def one(tree):
+            return self.match(tree, user_data, **kw)
+        if executor is not None:
+            return list(executor.map(one, trees))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(one, trees))
+
+async def _aiter(events):
+    for it in events:
+        yield it
+
+class MatchRun:
+    """
+    State of one matching of a MatchingBTree, fed event by event
+    """
+    def __init__(self, matcher, user_data=None, path=True,
+                 max_events=None, max_ticks=None, timeout=None, max_contexts=None,
+                 names=None, shared=None, retain=True, limit=None, overlap=Overlap.ALL,
+                 evict=Eviction.STOP):
+        self.matcher = matcher
+        # without retain the matches are only counted, with the captures
+        # stripped from the pattern
+        self.retain = retain
+        self.do = matcher.do if retain else matcher._uncaptured.do
+        # stop after this number of matches
+        self.limit = limit
+        self.overlap = Overlap(overlap)
+        # last end of the overlap policy, an event or a uid
+        self.last = None
+        # uid of each kept success, for OUTERMOST
+        self.uids = []
+        # with INNERMOST, a context started under a success can only
+        # succeed above it, but a Sibling succeed on a next sibling
+        self.prune = (self.overlap == Overlap.INNERMOST
+                      and not [item for item in items(matcher.bt) if isinstance(item, Sibling)])
+        self.user_data = user_data
+        # the matches are given for each name
+        self.names = [matcher.name] if names is None else names
+        # SharedTable of the Shared sub-patterns
+        self.shared = shared
+        # give the Path of the events to the matches
+        self.path = path
+        self.max_events = max_events
+        self.max_ticks = max_ticks
+        self.timeout = timeout
+        if max_contexts is not None and max_contexts < 1:
+            raise ValueError("max_contexts must be at least 1, not %r" % (max_contexts,))
+        self.max_contexts = max_contexts
+        self.evict = Eviction(evict)
+        self.start = time.monotonic()
+        self.glist = []
+        self.result = MatchResult()
+        self.cancelled = False
+        # a context can't succeed once the walk leave the subtree of the
+        # ancestor that is `h` levels upper than its first event
+        self.h = matcher.scope_height()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def feed_all(self, events):
+        for it in events:
+            if self.cancelled or not self.feed(it):
+                break
+
+    def feed(self, it) -> bool:
+        """
+            process one event, return False when the matching is stopped
+        """
+        match = self.result
+        glist = self.glist
+        h = self.h
+        max_ticks = self.max_ticks
+        user_data = self.user_data
+        log(it)
+        if match.exceeded is not None:
+            return False
+        if self.max_events is not None and match.events >= self.max_events:
+            match.budget_exceeded('max_events')
+            return False
+        if self.timeout is not None and time.monotonic() - self.start > self.timeout:
+            match.budget_exceeded('timeout')
+            return False
+        uid = it[Pos.UID]
+        start = True
+        if self.max_contexts is not None and len(glist) >= self.max_contexts:
+            if self.evict == Eviction.STOP:
+                match.budget_exceeded('max_contexts')
+                return False
+            if self.evict == Eviction.ABORT:
+                match.budget_exceeded('max_contexts')
+                raise ContextsExceeded(match)
+            match.dropped += 1
+            if self.evict == Eviction.OLDEST:
+                del glist[0]
+            elif self.evict == Eviction.DEEPEST:
+                # the oldest of the deepest, or the new one when deeper
+                idx = max(range(len(glist)), key=lambda i: len(glist[i].ustart))
+                if len(glist[idx].ustart) >= len(uid):
+                    del glist[idx]
+                else:
+                    start = False
+            else:
+                start = False
+        ring_event(match.events)
+        match.events += 1
+        log("LEN // %d" % len(glist))
+        path = it[Pos.PATH] if self.path and len(it) > Pos.PATH else None
+        if start:
+            ctx = MatchContext()
+            if self.shared is not None:
+                ctx.shared = self.shared
+            if h is not None:
+                ctx.sdepth = max(len(uid) - 1 - h, 0)
+                ctx.scope = uid[ctx.sdepth]
+            if self.overlap or self.evict == Eviction.DEEPEST:
+                ctx.start = match.events - 1
+                ctx.ustart = uid
+            glist.append(ctx)
+        match.contexts = max(match.contexts, len(glist))
+        # live contexts are rebuilt in one pass, keeping their order
+        alive = []
+        # uid of a success, the contexts started under it are pruned
+        doomed = None
+        for idx, g in enumerate(glist):
+            if max_ticks is not None and match.ticks >= max_ticks:
+                match.budget_exceeded('max_ticks')
+                # untouched contexts stay alive
+                alive.extend(glist[idx:])
+                break
+            if h is not None and (len(uid) <= g.sdepth or uid[g.sdepth] != g.scope):
+                log("OUT OF SCOPE REMOVE: %d" % idx)
+                match.expired += 1
+                continue
+            if doomed is not None and g.ustart[:len(doomed)] == doomed:
+                match.pruned += 1
+                continue
+            match.ticks += 1
+            log("MATCH TEST %d" % idx)
+            r = self.do(it, g, user_data)
+            log("MATCH RES %d %s" % (id(g), repr(r)))
+            if r == State.FAILED:
+                log("NOMATCH REMOVE: %d" % idx)
+                continue
+            if r == State.SUCCESS:
+                log("MATCH REMOVE: %d" % idx)
+                if self.overlap:
+                    kept = self.keep(g, uid)
+                    if self.prune:
+                        # they can only succeed above this node
+                        doomed = uid
+                        n = len(alive)
+                        alive = [a for a in alive if a.ustart[:len(uid)] != uid]
+                        match.pruned += n - len(alive)
+                    if not kept:
+                        continue
+                match.matched += len(self.names)
+                if self.retain:
+                    # keep only the result, the context tree is released
+                    capture = g.capture if hasattr(g, 'capture') else {}
+                    event = g.event if hasattr(g, 'event') else None
+                    nb_modif = g.nb_modif if hasattr(g, 'nb_modif') else 0
+                    for name in self.names:
+                        match.append(Match(capture, uid, path, name, event, nb_modif))
+                if self.limit is not None and match.matched >= self.limit:
+                    # the other contexts are dropped
+                    self.glist = []
+                    return False
+                if self.overlap == Overlap.NONOVERLAPPING:
+                    # all the live contexts started before this event
+                    match.pruned += len(alive) + len(glist) - idx - 1
+                    alive = []
+                    break
+                continue
+            alive.append(g)
+        self.glist = alive
+        log("%s\n" % ('-' * 20))
+        return match.exceeded is None
+
+    def keep(self, g, uid) -> bool:
+        """
+            apply the overlap policy to the success of g at uid
+        """
+        last = self.last
+        if self.overlap == Overlap.NONOVERLAPPING:
+            if last is not None and g.start <= last:
+                return False
+            self.last = self.result.events - 1
+            return True
+        if self.overlap == Overlap.INNERMOST:
+            # post-order, the matches under uid come just before
+            self.last = uid
+            return last is None or last[:len(uid)] != uid
+        uids = self.uids
+        if uids and uids[-1] == uid:
+            # one match by node
+            return False
+        n = 0
+        while n < len(uids) and uids[-1 - n][:len(uid)] == uid:
+            n += 1
+        if n:
+            # the kept matches under uid are the last ones
+            k = len(self.names)
+            self.result.matched -= k * n
+            if self.retain:
+                del self.result[-k * n:]
+            del uids[-n:]
+        uids.append(uid)
+        return True
+
+    def finish(self) -> MatchResult:
+        self.result.elapsed = time.monotonic() - self.start
+        return self.result
+
+class MatchSession:
+    """
+    Matching driven by the producer of the events, document after document
+
+    The events are the ones of walk, in the same bottom-up order, their
+    Path is optional. Each feed gives the new matches, close gives the
+    result of the document and make the session ready for the next one.
+    """
+    def __init__(self, matcher, user_data=None, **kw):
+        """
+            kw: the budgets and options of MatchRun
+        """
+        if kw.get('overlap') == Overlap.OUTERMOST:
+            raise ValueError("OUTERMOST matches are only known at the end of the walk")
+        self.matcher = matcher
+        self.user_data = user_data
+        self.kw = kw
+        self.open()
+
+    def open(self):
+        self.run = MatchRun(self.matcher, self.user_data, True, **self.kw)
+        self.done = 0
+        # last node given by a 'type' event, and if its branch event came
+        self.closed = None
+        self.linked = False
+        # last name of the key/attr branches of the open nodes
+        self.names = {}
+        # False once the run stopped, by a budget or the limit
+        self.running = True
+
+    @property
+    def result(self) -> MatchResult:
+        return self.run.result
+
+    def check(self, it):
+        """
+            cheap check of the order of the events, a node is closed by
+            its 'type' event, only its branch event can follow, the keys and
+            the attributes of a node come in sorted order like in walk
+        """
+        if len(it) <= Pos.UID or it[Pos.TYPE] not in KINDS:
+            raise ValueError("not an event: %r" % (it,))
+        uid = it[Pos.UID]
+        closed = self.closed
+        if closed is not None and uid[:len(closed)] == closed:
+            if len(uid) > len(closed) or self.linked or it[Pos.TYPE] not in BRANCHES:
+                raise ValueError("%s event in the closed node %r" % (it[Pos.TYPE], uid))
+        if it[Pos.TYPE] == 'type':
+            self.closed = uid
+            self.linked = False
+            if self.names:
+                self.names.pop(('key', tuple(uid)), None)
+                self.names.pop(('attr', tuple(uid)), None)
+        elif it[Pos.TYPE] in BRANCHES:
+            self.linked = True
+            if it[Pos.TYPE] != 'idx':
+                k = (it[Pos.TYPE], tuple(uid[:-1]))
+                last = self.names.get(k)
+                try:
+                    unsorted = last is not None and it[Pos.ARG] < last[0]
+                except TypeError:
+                    unsorted = False
+                if unsorted:
+                    raise ValueError("%s %r after %r, the names are not sorted" % (it[Pos.TYPE], it[Pos.ARG], last[0]))
+                self.names[k] = (it[Pos.ARG],)
+
+    def feed(self, it) -> list:
+        """
+            process one event, return the new matches, none once the run
+            stopped
+        """
+        self.check(it)
+        if not self.running:
+            return []
+        self.running = self.run.feed(it)
+        res = self.run.result[self.done:]
+        self.done += len(res)
+        return res
+
+    def feed_many(self, events) -> list:
+        res = []
+        for it in events:
+            res.extend(self.feed(it))
+        return res
+
+    def close(self) -> MatchResult:
+        """
+            end of the document, its result
+        """
+        res = self.run.finish()
+        self.open()
+        return res
+
+class MatchingForest:
+    """
+    Many patterns matched in one walk
+
+    The patterns are interned together, structurally equal patterns are
+    matched once and their matches given for each name, sub-patterns used
+    many times are Shared and computed once per tree position.
+    """
+    def __init__(self, patterns):
+        """
+            patterns: dict of name -> pattern
+        """
+        names = list(patterns)
+        roots = share([patterns[name] for name in names])
+        groups = {}
+        for name, root in zip(names, roots):
+            groups.setdefault(id(root), (root, []))[1].append(name)
+        self.matchers = [(MatchingBTree(root, group[0]), group) for root, group in groups.values()]
+        self.routed = any(m._routed for m, group in self.matchers)
+
+    def match(self, tree, user_data=None, path=False, **budgets) -> MatchResult:
+        """
+            matches of all the patterns, in the order of the walk
+
+            budgets are the ones of MatchingBTree.match, for each pattern,
+            but OUTERMOST, the matches of the patterns are merged during the
+            walk and an outer match is only known at its end
+        """
+        if budgets.get('overlap') == Overlap.OUTERMOST:
+            raise ValueError("OUTERMOST matches are only known at the end of the walk")
+        table = SharedTable()
+        runs = [MatchRun(m, user_data, path, names=names, shared=table, **budgets)
+                for m, names in self.matchers]
+        res = MatchResult()
+        root = Path(None, None, None, tree) if path or self.routed else None
+        for it in walk(tree, path=root):
+            table.next_event()
+            running = False
+            for run in runs:
+                if run.result.exceeded is not None:
+                    continue
+                done = len(run.result)
+                running |= run.feed(it)
+                res.extend(run.result[done:])
+            if not running:
+                break
+        for run in runs:
+            run.finish()
+            if run.result.exceeded is not None and res.exceeded is None:
+                res.budget_exceeded(run.result.exceeded)
+            res.matched += run.result.matched
+            res.events = max(res.events, run.result.events)
+            res.ticks += run.result.ticks
+            res.contexts += run.result.contexts
+            res.expired += run.result.expired
+            res.elapsed = max(res.elapsed, run.result.elapsed)
+        return res
 ###
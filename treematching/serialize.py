@@ -0,0 +1,113 @@
+"""
+    Serialize...
+
+    Save compiled patterns and matchers in a versioned binary format...
+
+    The format is a pickle of the items as they are in memory, behind a
+    header, to restore them without any analysis. It is not an exchange
+    format: loading a file runs the code it names, only load the files
+    you wrote yourself.
+
+    Types and Hook callables are stored by their qualified name, so they must
+    be importable when loading. The attributes of each class of the dump are
+    stored with it, a dump made before a change of the attributes of an item
+    is refused instead of giving items with a stale layout.
+"""
+
+import io
+import dis
+import pickle
+import struct
+import importlib
+from treematching.btitems import BTItem
+from treematching.matchingbtree import MatchingBTree, MatchingForest
+
+MAGIC = b'TMPT'
+# 2: MatchingBTree stores its uncaptured pattern
+# 3: the attributes of the classes are stored before the objects
+VERSION = 3
+# pickle protocol of the version 3 of the format
+PROTOCOL = 4
+HEADER = struct.Struct('<4sB')
+
+# classes whose attributes are checked
+CHECKED = (BTItem, MatchingBTree, MatchingForest)
+
+def layout(cls) -> tuple:
+    """
+    Names of the attributes of the instances of cls, its slots and the
+    attributes of self stored by its methods
+    """
+    names = set()
+    for klass in cls.__mro__:
+        slots = vars(klass).get('__slots__', ())
+        names.update((slots,) if isinstance(slots, str) else slots)
+        for f in vars(klass).values():
+            code = getattr(f, '__code__', None)
+            if code is None or not code.co_varnames:
+                continue
+            prev = None
+            for ins in dis.get_instructions(code):
+                if ins.opname == 'STORE_ATTR' and prev is not None \
+                   and prev.opname in ('LOAD_FAST', 'LOAD_DEREF') and prev.argval == code.co_varnames[0]:
+                    names.add(ins.argval)
+                prev = ins
+    return tuple(sorted(names))
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, f):
+        pickle.Pickler.__init__(self, f, protocol=PROTOCOL)
+        self.classes = set()
+
+    def reducer_override(self, obj):
+        if isinstance(obj, CHECKED):
+            self.classes.add(type(obj))
+        return NotImplemented
+
+def _find(name) -> type:
+    modname, qualname = name.split(':')
+    obj = importlib.import_module(modname)
+    for part in qualname.split('.'):
+        obj = getattr(obj, part)
+    return obj
+
+def dumps(obj) -> bytes:
+    """
+    Serialize a pattern, a MatchingBTree or a MatchingForest
+    """
+    f = io.BytesIO()
+    dump(obj, f)
+    return f.getvalue()
+
+def dump(obj, f):
+    data = io.BytesIO()
+    p = _Pickler(data)
+    p.dump(obj)
+    layouts = {'%s:%s' % (cls.__module__, cls.__qualname__): layout(cls) for cls in p.classes}
+    f.write(HEADER.pack(MAGIC, VERSION))
+    pickle.dump(layouts, f, protocol=PROTOCOL)
+    f.write(data.getvalue())
+
+def loads(data) -> object:
+    """
+    Restore an object saved by dumps, ready to run
+    """
+    return load(io.BytesIO(data))
+
+def load(f) -> object:
+    header = f.read(HEADER.size)
+    if len(header) != HEADER.size:
+        raise ValueError("not a serialized pattern")
+    magic, version = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("not a serialized pattern")
+    if version != VERSION:
+        raise ValueError("unsupported serialized pattern version %d" % version)
+    for name, names in pickle.load(f).items():
+        try:
+            cls = _find(name)
+        except (ImportError, AttributeError):
+            raise ValueError("%s of the dump can't be imported" % name)
+        if layout(cls) != names:
+            raise ValueError("the attributes of %s changed since the dump" % name)
+    return pickle.load(f)
@@ -0,0 +1,50 @@
+"""
+    Trace dump...
+
+    Decode a dump of the trace ring into human readable lines...
+
+    python -m treematching.tracedump trace.bin
+"""
+
+import sys
+import json
+from treematching.matchcontext import State
+from treematching.debug import TraceRing
+
+def decode(data) -> object:
+    """
+    Yield the lines of a dump made by TraceRing.dump
+    """
+    hsize = TraceRing.HEADER.size
+    magic, version, rsize, count, nbrec, tsize = TraceRing.HEADER.unpack_from(data, 0)
+    if magic != TraceRing.MAGIC:
+        raise ValueError("not a trace dump")
+    if version != TraceRing.VERSION or rsize != TraceRing.RECORD.size:
+        raise ValueError("unsupported trace dump version %d" % version)
+    nodes = json.loads(bytes(data[hsize:hsize + tsize]).decode('utf-8'))
+    yield "TRACE %d records, last %d kept" % (count, nbrec)
+    event = None
+    for idx in range(nbrec):
+        pos = hsize + tsize + idx * rsize
+        ev, node, ctx, old, new = TraceRing.RECORD.unpack_from(data, pos)
+        if ev != event:
+            if event is not None:
+                yield '-' * 20
+            yield "EVENT %d" % ev
+            event = ev
+        name = nodes.get(str(node), '?')
+        yield "%s %d SET RES %d FROM %s TO %s" % (name, node, ctx, State(old).name, State(new).name)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("usage: python -m treematching.tracedump FILE", file=sys.stderr)
+        return 2
+    with open(argv[0], 'rb') as f:
+        data = f.read()
+    for line in decode(data):
+        print(line)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+    XML source...
+
+    Events of walk straight from an XML stream, thru ElementTree.iterparse...
+
+    An element is an instance of the class of its tag (see tag_class), a
+    list of its child elements whose attributes are the XML attributes and
+    the stripped text, named '#text'. Tails of mixed content are dropped.
+
+    The elements are cleared once ended. A node is only kept in its parent
+    when the pattern can capture it or one of its ancestors, the others
+    only count their children, so the memory stays bounded by the open
+    elements and the captured subtrees. The tag classes are generated, a
+    pattern using them can't be serialized.
+"""
+
+import threading
+import xml.etree.ElementTree as ET
+from treematching.match import Path
+from treematching.matchingbtree import MatchingBTree, MatchRun
+from treematching.analysis import captured
+
+class XmlNode(list):
+    """
+    Base class of the tag classes
+    """
+    tag = None
+
+    def __repr__(self) -> str:
+        return "%s(%s, %r)" % (type(self).__name__, list.__repr__(self), vars(self))
+
+_classes = {}
+_lock = threading.Lock()
+
+def tag_class(tag) -> type:
+    """
+    Class of the elements of a tag, always the same for a tag
+    """
+    cls = _classes.get(tag)
+    if cls is None:
+        # namespaced tags are {uri}name
+        name = tag.rpartition('}')[2]
+        with _lock:
+            cls = _classes.setdefault(tag, type(name, (XmlNode,), {'tag': tag}))
+    return cls
+
+class _Frame:
+    __slots__ = ('elem', 'node', 'uid', 'path', 'keep', 'count')
+
+    def __init__(self, elem, node, uid, path, keep):
+        self.elem = elem
+        self.node = node
+        self.uid = uid
+        self.path = path
+        self.keep = keep
+        self.count = 0
+
+def _node_events(frame, path):
+    node = frame.node
+    uid = frame.uid
+    depth = uid[-1][0]
+    if frame.count:
+        # a node nobody can capture has only the number of its children
+        yield ('list', node if frame.keep else range(frame.count), 2, uid, frame.path)
+    attrs = vars(node)
+    nchild = frame.count
+    for k in sorted(attrs):
+        v = attrs[k]
+        nuid = uid + [(depth + 1, nchild)]
+        npath = Path(frame.path, 'attr', k, v) if path else None
+        yield ('value', v, 5, nuid, npath)
+        yield ('type', v, 6, nuid, npath)
+        yield ('attr', k, 3, nuid, npath)
+        nchild += 1
+    if attrs:
+        yield ('attrs', attrs, 4, uid, frame.path)
+    yield ('type', node, 6, uid, frame.path)
+
+def events(source, matcher=None, path=False) -> object:
+    """
+    Bottom-up events of an XML file name or file object
+
+    matcher: the MatchingBTree or pattern, only the nodes it can capture
+             are kept, all of them without matcher
+    path: also give the Path of each event
+    """
+    bt = matcher.bt if isinstance(matcher, MatchingBTree) else matcher
+    types = None if bt is None else captured(bt)
+    keeps = {}
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            yield from _events(f, types, keeps, path)
+    else:
+        yield from _events(source, types, keeps, path)
+
+def _events(f, types, keeps, path):
+    stack = []
+    for ev, elem in ET.iterparse(f, events=('start', 'end')):
+        if ev == 'start':
+            cls = tag_class(elem.tag)
+            node = cls()
+            node.__dict__.update(elem.attrib)
+            if cls not in keeps:
+                keeps[cls] = types is None or any(issubclass(cls, t) for t in types)
+            if stack:
+                parent = stack[-1]
+                uid = parent.uid + [(parent.uid[-1][0] + 1, parent.count)]
+                npath = Path(parent.path, 'idx', parent.count, node) if path else None
+                keep = keeps[cls] or parent.keep
+            else:
+                uid = [(0, 0)]
+                npath = Path(None, None, None, node) if path else None
+                keep = keeps[cls]
+            stack.append(_Frame(elem, node, uid, npath, keep))
+            continue
+        top = stack.pop()
+        text = elem.text.strip() if elem.text else None
+        if text:
+            top.node.__dict__['#text'] = text
+        # the element is done, the tree of iterparse stays empty
+        elem.clear()
+        if stack:
+            stack[-1].elem.remove(elem)
+        yield from _node_events(top, path)
+        if stack:
+            parent = stack[-1]
+            yield ('idx', parent.count, 1, top.uid, top.path)
+            parent.count += 1
+            if parent.keep:
+                parent.node.append(top.node)
+
+def match(matcher, source, user_data=None, path=False, **kw):
+    """
+    Matches of a MatchingBTree in an XML file name or file object,
+    kw are the budgets and options of MatchingBTree.match
+    """
+    run = MatchRun(matcher, user_data, path, **kw)
+    run.feed_all(events(source, matcher, path or matcher._routed))
+    return run.finish()